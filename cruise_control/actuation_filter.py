@@ -0,0 +1,76 @@
+import time
+
+from cruise_control.cruise_control_loop import ACCELERATE_RANGE_CENTIMETERS
+
+# A filter that sits between the cruise control loop and the robot, only letting commands through when the desired
+# acceleration state changes, adding hysteresis so that the vehicle does not chatter around the threshold distance,
+# and limiting the rate at which commands are sent
+# Created by brendon-ai, December 2017
+
+# The distance in centimeters beyond the accelerate range that the car ahead must reach before a stopped vehicle
+# accelerates again; stopping still happens as soon as the car ahead is within the accelerate range
+ACCELERATE_HYSTERESIS_CENTIMETERS = 5
+
+# The maximum number of commands that will be sent to the robot per second
+MAX_COMMANDS_PER_SECOND = 20
+
+# A value that can never be a state, used to mark that nothing has been sent yet
+NOTHING_SENT = object()
+
+
+# The filter class, which is updated with every result of the cruise control loop
+class ActuationFilter:
+    # The acceleration state that the vehicle should currently be in, which is the value that should be sent
+    state = None
+
+    # The last state that was actually delivered to the robot, and the time at which a send was last attempted
+    last_sent_state = NOTHING_SENT
+    last_send_time = None
+
+    # Counters for the number of updates that resulted in a command, and the number that were suppressed
+    sent_count = 0
+    suppressed_count = 0
+
+    # Configure the width of the hysteresis band and the maximum command rate
+    def __init__(self, hysteresis_centimeters=ACCELERATE_HYSTERESIS_CENTIMETERS,
+                 max_commands_per_second=MAX_COMMANDS_PER_SECOND):
+        self.hysteresis_centimeters = hysteresis_centimeters
+        self.minimum_send_interval = 1 / max_commands_per_second
+
+    # Update the filter with one result from the cruise control loop, returning True if the current state should be
+    # sent to the robot now and False if the command should be suppressed; the caller must call mark_sent once the
+    # state has actually been delivered, so that a command lost in transit is sent again on the next update
+    def update(self, accelerate, closest_distance):
+        # If there is no data, pass that on as its own state
+        if accelerate is None:
+            self.state = None
+        # If the loop says to stop, always stop immediately
+        elif not accelerate:
+            self.state = False
+        # If the vehicle is already accelerating, keep accelerating
+        elif self.state:
+            self.state = True
+        # If the vehicle is stopped, only accelerate once the car ahead is clear of the hysteresis band
+        else:
+            self.state = closest_distance >= ACCELERATE_RANGE_CENTIMETERS + self.hysteresis_centimeters
+
+        # If the state has not changed since it was last sent, there is no need to send anything
+        if self.state == self.last_sent_state:
+            self.suppressed_count += 1
+            return False
+
+        # If the last command was attempted too recently, hold this one back; since the sent state is unchanged, it
+        # will be sent on a later update if the state is still different by then
+        current_time = time.monotonic()
+        if self.last_send_time is not None and current_time - self.last_send_time < self.minimum_send_interval:
+            self.suppressed_count += 1
+            return False
+
+        # Otherwise, record the time of the attempt so the rate limit also applies to failed sends
+        self.last_send_time = current_time
+        return True
+
+    # Record that the current state has been delivered to the robot, so it is not sent again until it changes
+    def mark_sent(self):
+        self.last_sent_state = self.state
+        self.sent_count += 1
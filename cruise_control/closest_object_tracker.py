@@ -0,0 +1,65 @@
+# An alpha-beta filter that tracks the distance to the closest object ahead across scans, estimating the speed at which
+# the vehicle is closing in on it and the time remaining until a collision, using a constant amount of work per scan
+# Created by brendon-ai, December 2017
+
+# Weight given to each new distance measurement when correcting the predicted distance
+TRACKER_ALPHA = 0.5
+
+# Weight given to each new distance measurement when correcting the estimated closing speed
+TRACKER_BETA = 0.1
+
+# The difference in centimeters between a measurement and the predicted distance above which the measurement is
+# assumed to be a different object, and tracking starts over
+TRACKER_RESET_DISTANCE_CENTIMETERS = 50
+
+
+# The tracker class, which is updated with the closest distance from every scan
+class ClosestObjectTracker:
+    # The filtered distance in centimeters, the closing speed in centimeters per second (positive when the object is
+    # getting closer), and the time at which the last measurement was made
+    distance = None
+    closing_speed = 0
+    last_time = None
+
+    # Set the gains of the filter
+    def __init__(self, alpha=TRACKER_ALPHA, beta=TRACKER_BETA):
+        self.alpha = alpha
+        self.beta = beta
+
+    # Forget the tracked object
+    def reset(self):
+        self.distance = None
+        self.closing_speed = 0
+        self.last_time = None
+
+    # Update the tracker with a measured distance (or None if there is no object) and the time in seconds at which it
+    # was measured, and return the estimated time in seconds until a collision, or None if the object is not approaching
+    def update(self, measured_distance, measurement_time):
+        # If there is no object, stop tracking
+        if measured_distance is None:
+            self.reset()
+            return None
+
+        # If nothing is being tracked, or no time has passed since the last measurement, start tracking from here
+        if self.distance is None or measurement_time <= self.last_time:
+            self.distance = measured_distance
+            self.closing_speed = 0
+        else:
+            # Predict where the object should be now given its estimated closing speed
+            elapsed_time = measurement_time - self.last_time
+            predicted_distance = self.distance - self.closing_speed * elapsed_time
+            residual = measured_distance - predicted_distance
+            # If the measurement is far from the prediction, it is probably a different object, so start over
+            if abs(residual) > TRACKER_RESET_DISTANCE_CENTIMETERS:
+                self.distance = measured_distance
+                self.closing_speed = 0
+            # Otherwise, correct the prediction and the speed by a fraction of the residual
+            else:
+                self.distance = predicted_distance + self.alpha * residual
+                self.closing_speed -= self.beta * residual / elapsed_time
+        self.last_time = measurement_time
+
+        # If the object is approaching, the time to collision is the distance divided by the closing speed
+        if self.closing_speed > 0:
+            return self.distance / self.closing_speed
+        return None
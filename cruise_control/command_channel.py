@@ -0,0 +1,147 @@
+import socket
+import subprocess
+import time
+
+import paramiko
+
+# A long-lived channel for sending acceleration values to the robot, which keeps a single remote shell open instead of
+# starting a new one for every command, and reconnects automatically if the connection is dropped
+# Created by brendon-ai, December 2017
+
+# The file on the roboRIO that the robot code reads the acceleration value from
+ROBOT_DATA_FILE_PATH = '/home/lvuser/lidar.dat'
+
+# The maximum number of seconds that a single write to the channel may block before the connection is considered dead
+SEND_TIMEOUT_SECONDS = 0.1
+
+# The number of times to try reconnecting after the connection is dropped before giving up on a value
+RECONNECT_ATTEMPTS = 3
+
+# The number of seconds to wait between consecutive reconnection attempts
+RECONNECT_DELAY_SECONDS = 0.5
+
+
+# Format the shell command that writes a value to the data file, terminated by a newline so that it is run immediately
+def format_command(value, data_file_path):
+    return 'echo {} > {}\n'.format(value, data_file_path).encode()
+
+
+# A backend that keeps one interactive shell open on the roboRIO over SSH and writes commands into it
+class SSHCommandBackend:
+    # The SSH client and the channel to the remote shell, created when connecting
+    ssh_client = None
+    channel = None
+
+    # Store the connection details that are used every time the backend (re)connects
+    def __init__(self, hostname, username, password, data_file_path=ROBOT_DATA_FILE_PATH):
+        self.hostname = hostname
+        self.username = username
+        self.password = password
+        self.data_file_path = data_file_path
+
+    # Connect to the roboRIO and open a single shell that all future commands are written into
+    def connect(self):
+        # Create an SSH client and load host keys from the system SSH
+        self.ssh_client = paramiko.SSHClient()
+        self.ssh_client.load_system_host_keys()
+        self.ssh_client.connect(
+            hostname=self.hostname,
+            username=self.username,
+            password=self.password,
+            timeout=SEND_TIMEOUT_SECONDS * 10
+        )
+        # Open the persistent shell, and make writes fail rather than block for longer than the send timeout
+        self.channel = self.ssh_client.invoke_shell()
+        self.channel.settimeout(SEND_TIMEOUT_SECONDS)
+
+    # Write the command for a single value into the open shell
+    def send(self, value):
+        # Drain anything the shell has printed so its output buffer never fills up and stalls the channel
+        while self.channel.recv_ready():
+            self.channel.recv(4096)
+        self.channel.sendall(format_command(value, self.data_file_path))
+
+    # Close the shell and the SSH connection, ignoring errors since the connection may already be dead
+    def close(self):
+        for closeable in (self.channel, self.ssh_client):
+            if closeable is not None:
+                try:
+                    closeable.close()
+                except (OSError, EOFError, paramiko.ssh_exception.SSHException):
+                    pass
+        self.channel = None
+        self.ssh_client = None
+
+
+# A backend that runs a shell as a local subprocess, which stands in for the roboRIO when no robot is available
+class LocalShellCommandBackend:
+    # The shell subprocess, created when connecting
+    process = None
+
+    # Store the path of the local file that values should be written to
+    def __init__(self, data_file_path):
+        self.data_file_path = data_file_path
+
+    # Start a local shell that reads commands from its standard input
+    def connect(self):
+        self.process = subprocess.Popen(
+            ['sh'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+
+    # Write the command for a single value into the shell
+    def send(self, value):
+        self.process.stdin.write(format_command(value, self.data_file_path))
+        self.process.stdin.flush()
+
+    # Close the shell's input and wait for it to exit
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            self.process.wait()
+            self.process = None
+
+
+# The channel used by the cruise control script, which wraps any of the above backends and handles reconnection
+class CommandChannel:
+    # Whether the backend is currently believed to be connected
+    connected = False
+
+    # Take the backend to send commands through; it is not connected until the first value is sent
+    def __init__(self, backend):
+        self.backend = backend
+
+    # Connect the backend, letting any errors propagate so that the caller can report a failure to connect at startup
+    def connect(self):
+        self.backend.connect()
+        self.connected = True
+
+    # Send a value to the robot, reconnecting if necessary; return True if it was delivered and False otherwise
+    def send(self, value):
+        # Try once with the current connection and then once after every reconnection attempt
+        for attempt in range(RECONNECT_ATTEMPTS + 1):
+            # If this is not the first attempt, wait before trying to reconnect so a dead link is not hammered
+            if attempt > 0:
+                time.sleep(RECONNECT_DELAY_SECONDS)
+            try:
+                # Connect if the previous connection was dropped or there has never been one
+                if not self.connected:
+                    self.connect()
+                self.backend.send(value)
+                return True
+            # If the connection failed or the write did not complete within the timeout, drop the connection and retry
+            except (OSError, EOFError, socket.timeout, paramiko.ssh_exception.SSHException):
+                self.backend.close()
+                self.connected = False
+        # Give up on this value; the next call will try to reconnect again with a fresher value
+        return False
+
+    # Close the backend's connection
+    def close(self):
+        self.backend.close()
+        self.connected = False
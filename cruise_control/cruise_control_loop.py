@@ -1,4 +1,9 @@
-from sweeppy import Sweep
+import time
+
+from cruise_control.closest_object_tracker import ClosestObjectTracker
+from cruise_control.latency_trace import PIPELINE_TRACE
+from cruise_control.scan_queue import LatestScanQueue, ScanReaderThread
+from cruise_control.scan_sources import SweepScanSource
 
 # A script that handles slowing down the vehicle when close to another vehicle ahead, using the Sweep LIDAR sensor
 # Created by brendon-ai, November 2017
@@ -15,51 +20,110 @@ SEARCH_ANGLE = 10000
 # The minimum distance in centimeters to the car ahead at which the vehicle will enable the accelerator
 ACCELERATE_RANGE_CENTIMETERS = 40
 
+# The estimated time in seconds until a collision with the car ahead below which the vehicle will stop, even if the car
+# is still outside of the accelerate range
+MINIMUM_TIME_TO_COLLISION_SECONDS = 1
+
+# The number of seconds beyond the minimum time to collision that the estimate must reach before a vehicle that stopped
+# because a collision was imminent accelerates again, so that a noisy estimate does not make it chatter around the
+# threshold; the actuation filter's distance hysteresis does not apply here, since the car ahead may be far away
+TIME_TO_COLLISION_HYSTERESIS_SECONDS = 0.5
+
+# The distance reported by the sensor when nothing was detected (that is, the distance is infinite)
+INFINITE_DISTANCE = 1
+
+
+# Get the lowest distance to the car ahead within the predefined search angle of the center, or None if there is none
+def closest_distance_within_search_angle(samples):
+    # Get the angles and distances of all of the samples as arrays
+    angles = samples.angle
+    distances = samples.distance
+    # Select the samples whose angles are within the permissible range in either direction, and whose distances are
+    # not infinite
+    in_search_angle = (angles <= SEARCH_ANGLE) | (angles >= FULL_ROTATION_ANGLE - SEARCH_ANGLE)
+    valid_samples = in_search_angle & (distances != INFINITE_DISTANCE)
+    # If no points were found, return None
+    if not valid_samples.any():
+        return None
+    # Otherwise, return the lowest of the selected distances as a Python integer
+    return int(distances[valid_samples].min())
+
+
+# Main generator that runs forever, using the live Sweep sensor unless another source of scans is provided
+# The source is read on a background thread into a queue that discards stale scans, which can be provided by the caller
+# in order to inspect how many scans were dropped
+def automatic_cruise_control(scan_source=None, scan_queue=None):
+    # If no source was provided, create one using the constant device path
+    if scan_source is None:
+        scan_source = SweepScanSource(LIDAR_DEVICE_PATH)
+    # If no queue was provided, create one with the default length
+    if scan_queue is None:
+        scan_queue = LatestScanQueue()
+
+    # Start reading scans from the source in the background
+    reader_thread = ScanReaderThread(scan_source, scan_queue)
+    reader_thread.start()
+    # Stop the reader thread when this generator is finished, closed, or interrupted, so the source can clean up
+    try:
+        yield from process_queued_scans(scan_queue)
+    finally:
+        reader_thread.stop()
+
+
+# Run the cruise control logic on every scan taken from the queue, yielding a result for each one
+def process_queued_scans(scan_queue):
+    # Create a tracker that estimates how quickly the car ahead is being approached
+    tracker = ClosestObjectTracker()
+
+    # Whether the vehicle is currently stopped because a collision was imminent
+    collision_imminent = False
+
+    # Iterate over the scans in the queue, each of which is already an array of samples
+    while True:
+        # Wait for the newest scan, recording the time at which it arrived and how long it spent in the queue
+        queued_scan = scan_queue.get()
+        if queued_scan is None:
+            return
+        dequeue_time = time.perf_counter()
+        PIPELINE_TRACE.scan_arrival_time, scan_time, samples = queued_scan
+        PIPELINE_TRACE.record('queue wait', dequeue_time - PIPELINE_TRACE.scan_arrival_time)
+
+        # Get the lowest distance to the car ahead within the predefined search angle of the center
+        closest_distance = closest_distance_within_search_angle(samples)
+
+        # Update the tracker with the distance and the time at which the scan was received from the sensor (which is
+        # the recorded time when replaying, so decisions do not depend on the playback speed), getting the time to
+        # collision
+        time_to_collision = tracker.update(closest_distance, scan_time)
+
+        # A collision becomes imminent when the time to collision drops below the minimum, and stays imminent until it
+        # rises clear of the hysteresis band above the minimum, or the car ahead stops approaching
+        if time_to_collision is None:
+            collision_imminent = False
+        elif collision_imminent:
+            collision_imminent = time_to_collision < \
+                MINIMUM_TIME_TO_COLLISION_SECONDS + TIME_TO_COLLISION_HYSTERESIS_SECONDS
+        else:
+            collision_imminent = time_to_collision < MINIMUM_TIME_TO_COLLISION_SECONDS
+
+        # If no points were found, return None
+        if closest_distance is None:
+            result = (None,) * 4
+        # Otherwise, continue calculating the speed
+        else:
 
-# Main generator that runs forever
-def automatic_cruise_control():
-    # Create a device using the constant path
-    with Sweep(LIDAR_DEVICE_PATH) as sweep:
-        # Use the maximum sample rate
-        sweep.set_sample_rate(1000)
-
-        # Start scanning with the Sweep sensor
-        sweep.start_scanning()
-
-        # Iterate over the data stream provided by the sensor
-        for scan in sweep.get_scans():
-            # Get the lowest distance to the car ahead within the predefined search angle of the center
-            # Create an empty variable to store the lowest distance, starting at the maximum integer value
-            closest_distance_within_search_angle = None
-
-            # Iterate over the samples in the current scan
-            for sample in scan.samples:
-
-                # Get the distance and angle from the sample
-                distance = sample.distance
-                angle = sample.angle
-
-                # If the sample's angle is within the permissible range in either direction
-                if angle <= SEARCH_ANGLE or angle >= FULL_ROTATION_ANGLE - SEARCH_ANGLE:
-                    # If either the distance has not been set or the current distance is less than the least one so far
-                    if closest_distance_within_search_angle is None or distance < closest_distance_within_search_angle:
-                        # If the distance is not 1 (that is, it is not infinite)
-                        if distance != 1:
-                            # Set the closest distance to the current one
-                            closest_distance_within_search_angle = distance
-
-            # If no points were found, return None
-            if closest_distance_within_search_angle is None:
-                yield (None,) * 3
-            # Otherwise, continue calculating the speed
+            # If the closest distance is less than the predefined range, or the car ahead is being approached quickly
+            # enough that a collision is imminent, the vehicle should stop
+            if closest_distance < ACCELERATE_RANGE_CENTIMETERS or collision_imminent:
+                accelerate = False
+            # Otherwise, enable the accelerator
             else:
+                accelerate = True
 
-                # If the closest distance is less than the predefined range, the vehicle should stop
-                if closest_distance_within_search_angle < ACCELERATE_RANGE_CENTIMETERS:
-                    accelerate = False
-                # Otherwise, enable the accelerator
-                else:
-                    accelerate = True
+            # Package the speed, the array of samples, and the time to collision
+            result = accelerate, closest_distance, samples, time_to_collision
 
-                # Yield the speed and the list of samples to whatever is iterating over this generator
-                yield accelerate, closest_distance_within_search_angle, scan.samples
+        # Record how long the reduction took since the scan was taken from the queue, and yield the result to whatever is
+        # iterating over this generator
+        PIPELINE_TRACE.record_since('reduction', dequeue_time)
+        yield result
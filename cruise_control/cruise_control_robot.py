@@ -1,29 +1,72 @@
 import sys
+import time
 
 import paramiko
 
+from cruise_control.actuation_filter import ActuationFilter
+from cruise_control.command_channel import CommandChannel, LocalShellCommandBackend, SSHCommandBackend
 from cruise_control.cruise_control_loop import automatic_cruise_control
+from cruise_control.latency_trace import PIPELINE_TRACE, report_on_exit
+from cruise_control.scan_queue import LatestScanQueue
 
 # A script to run the cruise control loop and allow it to interface with the robot code running on the roboRIO
 # Created by brendon-ai, December 2017
 
-# Create an SSH client
-ssh_client = paramiko.SSHClient()
-# Load host keys from the system SSH
-ssh_client.load_system_host_keys()
-# Try to connect to the roboRIO
-try:
-    ssh_client.connect(
+# Verify that the number of command line arguments is correct
+if len(sys.argv) > 2:
+    print('Usage:', sys.argv[0], '[local data file to use instead of the roboRIO]')
+    sys.exit()
+
+# If a local file was provided, write the values to it through a local shell instead of connecting to the roboRIO
+if len(sys.argv) == 2:
+    backend = LocalShellCommandBackend(sys.argv[1])
+# Otherwise, use a persistent SSH shell on the roboRIO
+else:
+    backend = SSHCommandBackend(
         hostname='192.168.0.230',
         username='lvuser',
         password=''
     )
+
+# Wrap the backend in a channel that reconnects automatically if the connection is dropped
+command_channel = CommandChannel(backend)
+
+# Try to connect to the roboRIO (or start the local stand-in)
+try:
+    command_channel.connect()
 # If an error is thrown
-except (paramiko.ssh_exception.SSHException, EOFError):
+except (paramiko.ssh_exception.SSHException, EOFError, OSError):
     # Print an error and exit
     sys.exit('Failed to connect to the roboRIO')
 
-# Iterate over the cruise control loop
-for accelerate, _, _ in automatic_cruise_control():
-    # Run the command to write the acceleration value to a file on the roboRIO
-    ssh_client.exec_command('echo {} > /home/lvuser/lidar.dat'.format(accelerate))
+# Print the latencies of the pipeline's stages when the script exits
+report_on_exit()
+
+# Create a filter that only lets through changes in the acceleration state, at a limited rate
+actuation_filter = ActuationFilter()
+
+# Create the queue that scans are read into, so that the number of stale scans dropped can be printed out
+scan_queue = LatestScanQueue()
+
+# Iterate over the cruise control loop until the script is interrupted
+cruise_control = automatic_cruise_control(scan_queue=scan_queue)
+try:
+    for accelerate, closest_distance, _, _ in cruise_control:
+        # If the filter decides that the acceleration state should be sent to the robot
+        if actuation_filter.update(accelerate, closest_distance):
+            # Write the acceleration value to the file on the roboRIO through the persistent channel, recording how
+            # long the send took and how long it has been since the scan arrived
+            send_start_time = time.perf_counter()
+            delivered = command_channel.send(actuation_filter.state)
+            PIPELINE_TRACE.record_since('send', send_start_time)
+            # Only mark the state as sent if it was delivered, so that a lost command is retried on the next scan
+            if delivered:
+                actuation_filter.mark_sent()
+                PIPELINE_TRACE.record_since_arrival('scan to send')
+# When the script is stopped, stop reading from the sensor, close the channel, and print out how many scans were dropped
+# and commands were filtered
+finally:
+    cruise_control.close()
+    command_channel.close()
+    print('Scans received: {}, dropped: {}'.format(scan_queue.received_count, scan_queue.dropped_count))
+    print('Commands sent: {}, suppressed: {}'.format(actuation_filter.sent_count, actuation_filter.suppressed_count))
@@ -1,14 +1,18 @@
 import math
 import os
 import sys
+import threading
+import time
 
-from PyQt5.QtCore import QThread, pyqtSignal, QPoint, QPointF, Qt
-from PyQt5.QtGui import QImage, QPixmap, QPalette, QColor, QPolygon, QPainter
+import numpy as np
+from PyQt5.QtCore import QThread, QPoint, QPointF, Qt, QTimer
+from PyQt5.QtGui import QImage, QPixmap, QPalette, QColor, QPolygon, QPainter, QPen
 from PyQt5.QtWidgets import QWidget, QApplication, QLabel
 from skimage.io import imread
 from sweeppy import Sample
 
-from cruise_control.cruise_control_loop import automatic_cruise_control, SEARCH_ANGLE
+from cruise_control.cruise_control_loop import automatic_cruise_control, FULL_ROTATION_ANGLE, SEARCH_ANGLE
+from cruise_control.latency_trace import PIPELINE_TRACE, report_on_exit
 
 # A visualization tool for the cruise control system that displays the environmental point map on screen and the
 # calculated speed of the vehicle
@@ -29,11 +33,29 @@ DISTANCE_SCALING_FACTOR = 0.05
 # Diameter of the sample points drawn in the window
 SAMPLE_POINT_DIAMETER = 3
 
+# Lookup tables containing the X and Y components of the point on the unit circle for every angle in millidegrees,
+# calculated once so that projecting a scan onto the window only requires indexing into them
+UNIT_CIRCLE_RADIANS = np.radians(np.arange(FULL_ROTATION_ANGLE) / 1000)
+UNIT_CIRCLE_X_LOOKUP = np.sin(UNIT_CIRCLE_RADIANS)
+UNIT_CIRCLE_Y_LOOKUP = -np.cos(UNIT_CIRCLE_RADIANS)
+
+# Number of milliseconds between checks for a new scan, which limits the rate at which the window is redrawn
+REFRESH_INTERVAL_MILLISECONDS = 16
+
+# Number of seconds over which the frame rate displayed on screen is averaged
+FRAME_RATE_INTERVAL_SECONDS = 1
+
+# Factor by which every cell of the occupancy grid is multiplied for each new scan, so old obstacles gradually fade
+OCCUPANCY_DECAY_FACTOR = 0.95
+
+# Color in which the occupancy grid is drawn, with its opacity at each pixel determined by the occupancy
+OCCUPANCY_COLOR = (0xFF, 0xA0, 0x40)
+
 
 # Main PyQt5 QWidget class
 class CruiseControlVisualizer(QWidget):
-    # List of points in the window corresponding to the samples collected by the LIDAR
-    sample_points = []
+    # Polygon whose vertices are the points in the window corresponding to the samples collected by the LIDAR
+    sample_polygon = QPolygon()
 
     # The triangle that will be displayed on screen to mark the edges of the search range
     triangle = None
@@ -41,21 +63,54 @@ class CruiseControlVisualizer(QWidget):
     # The QLabel containing the red ar that will be moved depending on the proximity of objects to the LIDAR
     red_car_label = None
 
-    # Prepare the UI and data thread and run the main loop
-    def __init__(self):
+    # The thread that collects data from the LIDAR in the background
+    data_thread = None
+
+    # The number of the last scan that was displayed, and the number of scans that were replaced by newer ones before
+    # they could be displayed
+    displayed_scan_number = 0
+    dropped_frame_count = 0
+
+    # The time at which the scan waiting to be painted arrived from the sensor, or None if it has already been painted
+    undisplayed_scan_arrival_time = None
+
+    # The number of frames painted since the frame rate was last calculated, the time at which it was last calculated,
+    # and the most recently calculated frame rate
+    frames_since_frame_rate_update = 0
+    frame_rate_update_time = None
+    frame_rate = 0
+
+    # RGBA pixels of the data thread's occupancy grid, and the QImage that shares memory with them and is drawn on
+    # screen, if the occupancy grid is enabled
+    occupancy_pixels = None
+    occupancy_image = None
+
+    # Prepare the UI and data thread and run the main loop, optionally accumulating scans into an occupancy grid
+    def __init__(self, persist=False):
         # Call the QWidget initializer
         super(CruiseControlVisualizer, self).__init__()
 
-        # Create an instance of the data thread that takes information from the LIDAR in the background
-        data_thread = CruiseControlVisualizerDataThread()
-        # Connect the data signal to the UI update function in the main thread
-        data_thread.data_signal.connect(self.update_ui)
-        # Start the data thread
-        data_thread.start()
+        # If persistence is enabled, create an image of the same size as the data thread's occupancy grid to display it
+        if persist:
+            self.occupancy_pixels = np.zeros((WINDOW_SIDE_LENGTH, WINDOW_SIDE_LENGTH, 4), dtype=np.uint8)
+            self.occupancy_pixels[:, :, :3] = OCCUPANCY_COLOR
+            self.occupancy_image = QImage(self.occupancy_pixels.data, WINDOW_SIDE_LENGTH, WINDOW_SIDE_LENGTH,
+                                          WINDOW_SIDE_LENGTH * 4, QImage.Format_RGBA8888)
+
+        # Create an instance of the data thread that takes information from the LIDAR in the background, and start it
+        self.data_thread = CruiseControlVisualizerDataThread(persist)
+        self.data_thread.start()
 
         # Initialize the user interface
         self.init_ui()
 
+        # Start a timer that checks for a new scan at a fixed rate, so that however quickly the data thread produces
+        # scans, only the latest one is displayed and no more than one redraw is scheduled at a time
+        self.frame_rate_update_time = time.perf_counter()
+        refresh_timer = QTimer(self)
+        refresh_timer.timeout.connect(self.refresh)
+        refresh_timer.start(REFRESH_INTERVAL_MILLISECONDS)
+
     # Create the window and all elements within it
     def init_ui(self):
         # Set the window's size and title
@@ -120,22 +175,36 @@ class CruiseControlVisualizer(QWidget):
         # Display the window on screen
         self.show()
 
+    # Called by the timer to display the latest scan from the data thread, if there is one that has not been displayed
+    def refresh(self):
+        # Get the number of the latest scan, the time at which it arrived, and the corresponding data
+        scan_number, arrival_time, data = self.data_thread.latest_scan
+        # If it has already been displayed, there is nothing to do
+        if scan_number == self.displayed_scan_number:
+            return
+        # Count every scan between this one and the last one displayed as a dropped frame
+        self.dropped_frame_count += scan_number - self.displayed_scan_number - 1
+        self.displayed_scan_number = scan_number
+        # Update the user interface using the data, recording how long it took and remembering when the scan arrived
+        # so that the total latency can be recorded once it has been painted
+        update_start_time = time.perf_counter()
+        self.update_ui(data)
+        PIPELINE_TRACE.record_since('ui update', update_start_time)
+        self.undisplayed_scan_arrival_time = arrival_time
+
     # Update the user interface using data retrieved from the data thread
     def update_ui(self, data):
-        # Clear the global list of sample points
-        self.sample_points = []
+        # Clear the global polygon of sample points
+        self.sample_polygon = QPolygon()
 
         # If valid data has been returned
         if data[0] is not None:
             # Unwrap the data tuple
-            accelerate, closest_distance_within_search_angle, samples = data
+            accelerate, closest_distance_within_search_angle, samples, _ = data
 
-            # Iterate over the samples
-            for sample in samples:
-                # Calculate a point in the window based on the sample
-                sample_point = self.sample_to_point_on_window(sample)
-                # Add the point to the global list
-                self.sample_points.append(sample_point)
+            # Project all of the samples onto the window at once, and make them into a polygon for drawing
+            sample_positions = self.samples_to_positions_on_window(samples)
+            self.sample_polygon = self.positions_to_polygon(sample_positions)
 
             # Create a sample using the closest distance and an angle of zero
             closest_distance_sample = Sample(
@@ -152,8 +221,14 @@ class CruiseControlVisualizer(QWidget):
             # Set the car's position accordingly
             self.red_car_label.move(red_car_position)
 
-        # Redraw the window
-        self.repaint()
+        # If the occupancy grid is enabled, write the data thread's occupancy, which includes every scan since the
+        # last refresh, into the alpha channel of the image's pixels
+        if self.occupancy_image is not None:
+            with self.data_thread.occupancy_lock:
+                self.occupancy_pixels[:, :, 3] = self.data_thread.occupancy_grid * 255
+
+        # Schedule a redraw of the window, without blocking until it is complete
+        self.update()
 
     # Called when the window is redrawn and used to display all of the sample points on the window
     def paintEvent(self, _):
@@ -166,17 +241,34 @@ class CruiseControlVisualizer(QWidget):
         painter.setPen(Qt.lightGray)
         painter.drawPolygon(self.triangle)
 
-        # Paint the sample points in light gray with a light gray outline
-        painter.setBrush(Qt.lightGray)
-        painter.setPen(Qt.lightGray)
-        # Iterate over the sample points and draw them
-        for sample_point in self.sample_points:
-            # Draw the point on screen
-            painter.drawEllipse(sample_point, SAMPLE_POINT_DIAMETER, SAMPLE_POINT_DIAMETER)
+        # If the occupancy grid is enabled, draw it over the whole window in a single call
+        if self.occupancy_image is not None:
+            painter.drawImage(0, 0, self.occupancy_image)
+
+        # Paint all of the sample points in a single call as light gray circles, using a wide pen with round ends
+        painter.setPen(QPen(Qt.lightGray, SAMPLE_POINT_DIAMETER * 2, Qt.SolidLine, Qt.RoundCap))
+        painter.drawPoints(self.sample_polygon)
+
+        # Count this frame, and recalculate the frame rate if enough time has passed since it was last calculated
+        self.frames_since_frame_rate_update += 1
+        current_time = time.perf_counter()
+        elapsed_time = current_time - self.frame_rate_update_time
+        if elapsed_time >= FRAME_RATE_INTERVAL_SECONDS:
+            self.frame_rate = self.frames_since_frame_rate_update / elapsed_time
+            self.frames_since_frame_rate_update = 0
+            self.frame_rate_update_time = current_time
+        # Display the frame rate and the number of dropped frames in the top left corner in white
+        painter.setPen(Qt.white)
+        painter.drawText(10, 20, 'FPS: {:.1f}    Dropped frames: {}'.format(self.frame_rate, self.dropped_frame_count))
 
         # Stop painting
         painter.end()
 
+        # If a new scan has just been painted, record how long it has been since it arrived
+        if self.undisplayed_scan_arrival_time is not None:
+            PIPELINE_TRACE.record_since('scan to display', self.undisplayed_scan_arrival_time)
+            self.undisplayed_scan_arrival_time = None
+
     # A function to convert an angle in millidegrees to a corresponding point on the unit circle
     @staticmethod
     def angle_to_point_on_unit_circle(angle_millidegrees):
@@ -201,26 +293,82 @@ class CruiseControlVisualizer(QWidget):
         # Offset the point so that its origin is halfway across the window in both dimensions and return it
         return scaled_vector_qpoint + (QPoint(WINDOW_CENTER, WINDOW_CENTER))
 
-
-# The data thread that runs forever, accepting values from the LIDAR and displaying them on screen
+    # A function to convert an array of samples into an array of integer X and Y positions around the center of the
+    # window, with one row per sample
+    @staticmethod
+    def samples_to_positions_on_window(samples):
+        # Look up the unit circle vectors for all of the angles, and scale them by the distances of the samples
+        angles = samples.angle % FULL_ROTATION_ANGLE
+        distances = samples.distance
+        positions = np.empty((len(samples), 2), dtype=np.int32)
+        positions[:, 0] = np.round(UNIT_CIRCLE_X_LOOKUP[angles] * distances) + WINDOW_CENTER
+        positions[:, 1] = np.round(UNIT_CIRCLE_Y_LOOKUP[angles] * distances) + WINDOW_CENTER
+        return positions
+
+    # A function to convert an array of integer X and Y positions into a polygon with those positions as vertices
+    @staticmethod
+    def positions_to_polygon(positions):
+        # If there are no positions, return an empty polygon, which has no buffer to write into
+        if not len(positions):
+            return QPolygon()
+        # Create a polygon with one vertex per position, and copy the positions directly into its buffer of integer X
+        # and Y pairs
+        polygon = QPolygon(len(positions))
+        polygon_buffer = polygon.data()
+        polygon_buffer.setsize(positions.nbytes)
+        np.frombuffer(polygon_buffer, dtype=np.int32).reshape(-1, 2)[:] = positions
+        return polygon
+
+
+# The data thread that runs forever, accepting values from the LIDAR and handing them to the UI thread
 class CruiseControlVisualizerDataThread(QThread):
-    # The signal that is called when it is time to transfer data to the main thread
-    data_signal = pyqtSignal(tuple)
-
-    # Initializer containing nothing but a call to the QThread initializer
-    def __init__(self):
+    # The number of the latest scan and the time at which it arrived along with its data, which the UI thread reads
+    # whenever it is ready for a new frame
+    # The tuple is replaced in a single assignment, so the UI thread never sees a number that does not match the data
+    latest_scan = (0, None, None)
+
+    # Grid with one cell per pixel in the window, containing the decaying occupancy of each pixel, if it is enabled
+    # Every scan is added to it, including those that are replaced before the UI thread displays them, so it decays at
+    # the rate at which scans arrive; the UI thread holds the lock while copying it
+    occupancy_grid = None
+    occupancy_lock = None
+
+    # Call the QThread initializer, and create the occupancy grid if persistence is enabled
+    def __init__(self, persist=False):
         QThread.__init__(self)
+        if persist:
+            self.occupancy_grid = np.zeros((WINDOW_SIDE_LENGTH, WINDOW_SIDE_LENGTH), dtype=np.float32)
+            self.occupancy_lock = threading.Lock()
 
     # The function containing the logic of the main loop
     def run(self):
         # Iterate over the automatic cruise control generator
         for data in automatic_cruise_control():
-            # Send the speed and samples through the signal to the UI thread
-            self.data_signal.emit(data)
+            # If the occupancy grid is enabled and the scan is valid, add its samples to the grid
+            if self.occupancy_grid is not None and data[0] is not None:
+                self.update_occupancy_grid(CruiseControlVisualizer.samples_to_positions_on_window(data[2]))
+            # Replace the latest scan with the speed and samples, along with the time at which the scan arrived so that
+            # the UI thread can measure the latency until it is displayed
+            self.latest_scan = (self.latest_scan[0] + 1, PIPELINE_TRACE.scan_arrival_time, data)
+
+    # Fade the occupancy grid and mark the pixels at the provided positions as fully occupied
+    def update_occupancy_grid(self, positions):
+        # Only use the positions that are within the window
+        in_window = np.all((positions >= 0) & (positions < WINDOW_SIDE_LENGTH), axis=1)
+        x_positions, y_positions = positions[in_window].T
+        with self.occupancy_lock:
+            self.occupancy_grid *= OCCUPANCY_DECAY_FACTOR
+            self.occupancy_grid[y_positions, x_positions] = 1
 
 
 # If this file is being run directly, instantiate the ManualSelection class
 if __name__ == '__main__':
+    # Verify that the command line arguments are correct
+    if sys.argv[1:] not in ([], ['--persist']):
+        print('Usage:', sys.argv[0], '[--persist]')
+        sys.exit()
+    # Print the latencies of the pipeline's stages when the window is closed
+    report_on_exit()
     app = QApplication([])
-    ic = CruiseControlVisualizer()
+    ic = CruiseControlVisualizer(persist='--persist' in sys.argv)
     sys.exit(app.exec_())
@@ -0,0 +1,106 @@
+import atexit
+import os
+import time
+
+import numpy as np
+
+# Instrumentation for measuring the latency of each stage of the cruise control pipeline, from a scan arriving from
+# the sensor to the acceleration command being sent to the robot or the scan being displayed by the visualizer
+# Created by brendon-ai, December 2017
+
+# The stages of the pipeline that latencies are recorded for
+STAGES = (
+    # Time the reader thread spent waiting for the next scan from the source
+    'sensor read',
+    # Time a scan spent in the queue between the reader thread adding it and the loop taking it
+    'queue wait',
+    # Time spent finding the closest distance and deciding whether to accelerate
+    'reduction',
+    # Time spent sending a command to the robot
+    'send',
+    # Time spent by the visualizer's UI thread updating the window with a new scan
+    'ui update',
+    # Total time from a scan arriving to the command being sent
+    'scan to send',
+    # Total time from a scan arriving to it being painted in the visualizer's window
+    'scan to display'
+)
+
+# The number of latencies kept for each stage, after which the oldest ones are overwritten
+TRACE_CAPACITY = 100000
+
+# The percentiles reported in the summary
+SUMMARY_PERCENTILES = (50, 95, 99)
+
+# The environment variable containing the path of a file to save the recorded latencies to on exit, if it is set
+TRACE_PATH_VARIABLE = 'CRUISE_CONTROL_TRACE_PATH'
+
+
+# A set of fixed-size ring buffers, one per stage, that latencies are written into
+# Every stage is only ever written by a single thread and the buffers are preallocated, so no locking is needed
+class LatencyTrace:
+    # The time at which the scan currently being processed arrived from the sensor and was added to the queue
+    scan_arrival_time = None
+
+    # Allocate the buffers and the count of latencies recorded for each stage
+    def __init__(self, capacity=TRACE_CAPACITY):
+        self.capacity = capacity
+        self.latencies = {stage: np.zeros(capacity) for stage in STAGES}
+        self.counts = {stage: 0 for stage in STAGES}
+
+    # Record a latency in seconds for a stage, overwriting the oldest one if the buffer is full
+    def record(self, stage, latency):
+        self.latencies[stage][self.counts[stage] % self.capacity] = latency
+        self.counts[stage] += 1
+
+    # Record the latency of a stage that started at the provided time and ended now
+    def record_since(self, stage, start_time):
+        self.record(stage, time.perf_counter() - start_time)
+
+    # Record the time elapsed since the current scan arrived under the provided end-to-end stage
+    def record_since_arrival(self, stage):
+        if self.scan_arrival_time is not None:
+            self.record_since(stage, self.scan_arrival_time)
+
+    # Get the latencies currently held for a stage, in the order they were recorded
+    def stage_latencies(self, stage):
+        count = self.counts[stage]
+        # If the buffer has not wrapped around yet, the latencies are at the beginning of the buffer
+        if count <= self.capacity:
+            return self.latencies[stage][:count]
+        # Otherwise, the oldest latency is at the position that will be written next
+        return np.roll(self.latencies[stage], -(count % self.capacity))
+
+    # Create a list of lines summarizing the percentiles of every stage that has recorded latencies, in milliseconds
+    def summary(self):
+        lines = []
+        for stage in STAGES:
+            latencies = self.stage_latencies(stage)
+            if len(latencies):
+                percentiles = np.percentile(latencies, SUMMARY_PERCENTILES) * 1000
+                lines.append('{}: {} samples, '.format(stage, len(latencies)) + ', '.join(
+                    'p{}: {:.3f} ms'.format(percentile, value)
+                    for percentile, value in zip(SUMMARY_PERCENTILES, percentiles)
+                ))
+        return lines
+
+    # Save the latencies of every stage to a NumPy archive, with spaces in the stage names replaced by underscores
+    def export(self, path):
+        np.savez(path, **{stage.replace(' ', '_'): self.stage_latencies(stage) for stage in STAGES})
+
+    # Print the summary, and save the latencies if a path is provided in the environment
+    def report(self):
+        for line in self.summary():
+            print(line)
+        trace_path = os.environ.get(TRACE_PATH_VARIABLE)
+        if trace_path:
+            self.export(trace_path)
+
+
+# The single trace shared by all parts of the pipeline
+PIPELINE_TRACE = LatencyTrace()
+
+
+# Report the pipeline's latencies when the script exits
+def report_on_exit():
+    atexit.register(PIPELINE_TRACE.report)
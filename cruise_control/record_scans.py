@@ -0,0 +1,23 @@
+import sys
+
+from cruise_control.cruise_control_loop import LIDAR_DEVICE_PATH
+from cruise_control.scan_sources import ScanRecorder, SweepScanSource
+
+# A script to record the scans from the Sweep sensor to a file, so that they can be replayed later without the sensor
+# Created by brendon-ai, December 2017
+
+# Verify that the number of command line arguments is correct
+if len(sys.argv) != 2:
+    print('Usage:', sys.argv[0], '<recording file>')
+    sys.exit()
+
+# Wrap the live sensor in a recorder that saves to the provided file
+recorder = ScanRecorder(SweepScanSource(LIDAR_DEVICE_PATH), sys.argv[1])
+
+# Consume the scans until the script is interrupted, printing the number recorded so far on a single line
+try:
+    for _ in recorder:
+        print('Scans recorded:', recorder.scan_count, end='\r')
+# When the script is stopped, print the final count
+except KeyboardInterrupt:
+    print('\nRecorded', recorder.scan_count, 'scans to', sys.argv[1])
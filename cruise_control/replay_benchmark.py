@@ -0,0 +1,45 @@
+import sys
+import time
+
+from cruise_control.actuation_filter import ActuationFilter
+from cruise_control.cruise_control_loop import automatic_cruise_control
+from cruise_control.latency_trace import report_on_exit
+from cruise_control.scan_queue import LatestScanQueue, SCAN_QUEUE_LENGTH
+from cruise_control.scan_sources import ReplayScanSource
+
+# A script to measure the throughput of the cruise control pipeline by replaying a recording of scans through it
+# Created by brendon-ai, December 2017
+
+# Verify that the number of command line arguments is correct
+if len(sys.argv) not in (2, 3):
+    print('Usage:', sys.argv[0], '<recording file> [playback speed, omitted to play as fast as possible]')
+    sys.exit()
+
+# Get the playback speed if one was provided
+speed = float(sys.argv[2]) if len(sys.argv) == 3 else None
+
+# Print the latencies of the pipeline's stages when the benchmark finishes
+report_on_exit()
+
+# Create the replay source and the filter that the robot script passes the output of the loop through
+scan_source = ReplayScanSource(sys.argv[1], speed)
+actuation_filter = ActuationFilter()
+# Create the queue that scans are read into, so that the number of scans dropped because the loop fell behind is known
+# When playing as fast as possible, the queue is unbounded so that every scan is processed and the throughput is measured
+scan_queue = LatestScanQueue(None if speed is None else SCAN_QUEUE_LENGTH)
+
+# Run the whole recording through the cruise control loop and the filter, counting the scans and timing the run
+scan_count = 0
+start_time = time.perf_counter()
+for accelerate, closest_distance, _, _ in automatic_cruise_control(scan_source, scan_queue):
+    # Treat every command the filter lets through as delivered, since nothing is actually sent to the robot
+    if actuation_filter.update(accelerate, closest_distance):
+        actuation_filter.mark_sent()
+    scan_count += 1
+elapsed_time = time.perf_counter() - start_time
+
+# Print out the throughput, the number of scans dropped, and the number of commands that would have been sent
+print('Processed {} scans in {:.3f} seconds ({:.1f} scans per second)'
+      .format(scan_count, elapsed_time, scan_count / elapsed_time))
+print('Scans received: {}, dropped: {}'.format(scan_queue.received_count, scan_queue.dropped_count))
+print('Commands sent: {}, suppressed: {}'.format(actuation_filter.sent_count, actuation_filter.suppressed_count))
@@ -0,0 +1,108 @@
+import collections
+import threading
+import time
+
+from cruise_control.latency_trace import PIPELINE_TRACE
+
+# A bounded queue that discards the oldest scans when it is full, and a thread that reads scans from a source into it,
+# so that the sensor is read continuously and slow consumers always process the newest scan available
+# Created by brendon-ai, December 2017
+
+# The default number of scans held in the queue before the oldest ones start to be discarded
+SCAN_QUEUE_LENGTH = 1
+
+# The maximum number of seconds to wait for the reader thread to finish after it has been asked to stop, which is long
+# enough for the sensor to deliver its next scan
+READER_STOP_TIMEOUT_SECONDS = 1
+
+
+# A thread-safe queue of scans that drops the oldest scan whenever a new one is added while it is full
+class LatestScanQueue:
+    # The number of scans that have been added to the queue and the number that were discarded before being read
+    received_count = 0
+    dropped_count = 0
+
+    # Whether the source has finished, and the error that stopped it if there was one
+    closed = False
+    error = None
+
+    # Create the underlying double-ended queue and the condition used to wait for scans
+    def __init__(self, length=SCAN_QUEUE_LENGTH):
+        self.scans = collections.deque(maxlen=length)
+        self.condition = threading.Condition()
+
+    # Add a scan to the queue, discarding the oldest one if it is full
+    def put(self, scan):
+        with self.condition:
+            # The deque discards the oldest scan by itself, so only count it
+            if len(self.scans) == self.scans.maxlen:
+                self.dropped_count += 1
+            self.scans.append(scan)
+            self.received_count += 1
+            self.condition.notify()
+
+    # Mark the queue as closed once the source has no more scans, optionally with the error that stopped it
+    def close(self, error=None):
+        with self.condition:
+            self.closed = True
+            self.error = error
+            self.condition.notify()
+
+    # Wait for a scan and remove it from the queue, returning None if the queue is closed and empty
+    def get(self):
+        with self.condition:
+            while not self.scans and not self.closed:
+                self.condition.wait()
+            # If there are scans left, return the oldest one that has been kept
+            if self.scans:
+                return self.scans.popleft()
+            # Otherwise the queue has been closed, so pass on the source's error if there was one
+            if self.error is not None:
+                raise self.error
+            return None
+
+
+# A background thread that reads every scan from a source and adds it to a queue along with the time it arrived, as
+# measured by the performance counter for latency tracing, and the source's own timestamp for the scan
+class ScanReaderThread(threading.Thread):
+    # Store the source and queue, and run as a daemon so that the thread cannot keep the program alive if it fails to
+    # stop in time
+    def __init__(self, scan_source, scan_queue):
+        super(ScanReaderThread, self).__init__(daemon=True)
+        self.scan_source = scan_source
+        self.scan_queue = scan_queue
+        self.stop_event = threading.Event()
+
+    # Ask the thread to stop after the scan it is currently reading, and wait for it to finish, so that the source can
+    # clean up (for example, stopping the sensor) before the program exits
+    def stop(self, timeout=READER_STOP_TIMEOUT_SECONDS):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    # Read scans until the source is exhausted or the thread is stopped, recording how long each one took to read from
+    # the source, and close the queue afterwards
+    def run(self):
+        scans = iter(self.scan_source)
+        try:
+            while True:
+                read_start_time = time.perf_counter()
+                try:
+                    timestamp, samples = next(scans)
+                except StopIteration:
+                    break
+                arrival_time = time.perf_counter()
+                # This thread is the only one that records this stage, so the trace needs no locking
+                PIPELINE_TRACE.record('sensor read', arrival_time - read_start_time)
+                if self.stop_event.is_set():
+                    break
+                self.scan_queue.put((arrival_time, timestamp, samples))
+        # If reading failed, hand the error over to the consumer
+        except Exception as error:
+            self.scan_queue.close(error)
+        else:
+            self.scan_queue.close()
+        # Close the source's generator from this thread, which exits any context managers within it
+        finally:
+            if hasattr(scans, 'close'):
+                scans.close()
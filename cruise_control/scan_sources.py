@@ -0,0 +1,152 @@
+import os
+import time
+
+import numpy as np
+
+# Sources of LIDAR scans for the cruise control loop: the live Sweep sensor, a recorder that saves the scans passing
+# through it to a binary file, and a replay source that reads such a file back so the loop can run without the sensor
+# Every source yields pairs of the Unix time at which a scan was received from the sensor and the scan's samples, so
+# that the timing of a replayed recording is the same as when it was recorded, however quickly it is played back
+# Created by brendon-ai, December 2017
+
+# The sample rate used for the Sweep sensor, which is the maximum it supports
+SWEEP_SAMPLE_RATE = 1000
+
+# The structured data type used to store the samples of a scan, with the same fields as the Sweep sample tuple
+SAMPLE_DTYPE = np.dtype([
+    ('angle', np.int32),
+    ('distance', np.int32),
+    ('signal_strength', np.int32)
+])
+
+# The data type of a single fixed-width record in a recording file, which holds one sample along with the index of the
+# scan it belongs to and the Unix time at which that scan was received
+RECORD_DTYPE = np.dtype([
+    ('scan_index', np.uint32),
+    ('timestamp', np.float64),
+    ('angle', np.int32),
+    ('distance', np.int32),
+    ('signal_strength', np.int32)
+])
+
+# The bytes at the start of every recording file, which identify the format and its version
+RECORDING_HEADER = b'SWEEPREC\x01\x00\x00\x00'
+
+
+# Convert a scan from the Sweep sensor into a NumPy record array with one row per sample, so that the fields can be
+# accessed as whole arrays (samples.angle, samples.distance, samples.signal_strength) or as attributes of single rows
+def scan_to_array(scan):
+    # The samples are named tuples, so NumPy can fill the structured array directly without any Python-level loop
+    return np.array(scan.samples, dtype=SAMPLE_DTYPE).view(np.recarray)
+
+
+# Convert an array of samples into an array of records for a recording file, marked with a scan index and timestamp
+def samples_to_records(samples, scan_index, timestamp):
+    # Create an array of records and copy the sample fields into it
+    records = np.empty(len(samples), dtype=RECORD_DTYPE)
+    for field_name in SAMPLE_DTYPE.names:
+        records[field_name] = samples[field_name]
+    # Mark all of the records with the scan's index and time of arrival
+    records['scan_index'] = scan_index
+    records['timestamp'] = timestamp
+    return records
+
+
+# A source that reads scans from the physical Sweep sensor
+class SweepScanSource:
+    # Store the path to the sensor's serial device
+    def __init__(self, device_path):
+        self.device_path = device_path
+
+    # Open the sensor and yield each of its scans as an array of samples, paired with the time at which it was received
+    def __iter__(self):
+        # Import the sensor library here, so that the other sources can be used on computers where it is not installed
+        from sweeppy import Sweep
+
+        # Create a device using the provided path
+        with Sweep(self.device_path) as sweep:
+            # Use the maximum sample rate
+            sweep.set_sample_rate(SWEEP_SAMPLE_RATE)
+
+            # Start scanning with the Sweep sensor
+            sweep.start_scanning()
+
+            # Convert each scan in the data stream provided by the sensor to an array and yield it with the current time
+            for scan in sweep.get_scans():
+                yield time.time(), scan_to_array(scan)
+
+
+# A source that passes through the scans from another source, while saving them to a recording file
+class ScanRecorder:
+    # The number of scans that have been recorded so far
+    scan_count = 0
+
+    # Store the source to record and the path of the file to save the recording to
+    def __init__(self, source, recording_path):
+        self.source = source
+        self.recording_path = recording_path
+
+    # Yield each scan from the wrapped source after writing it to the recording file
+    def __iter__(self):
+        # Create the file and write the header that identifies it
+        with open(self.recording_path, 'wb') as recording_file:
+            recording_file.write(RECORDING_HEADER)
+            # Iterate over the scans, writing the records for each scan in a single call
+            for timestamp, samples in self.source:
+                records = samples_to_records(samples, self.scan_count, timestamp)
+                recording_file.write(records.tobytes())
+                # Flush the file so that the recording is usable even if the script is stopped abruptly
+                recording_file.flush()
+                self.scan_count += 1
+                yield timestamp, samples
+
+
+# A source that plays back scans from a recording file, either at the speed they were recorded multiplied by a factor,
+# or as fast as possible if the speed is None
+class ReplayScanSource:
+    # Store the path of the recording and the speed to play it back at
+    def __init__(self, recording_path, speed=1.0):
+        self.recording_path = recording_path
+        self.speed = speed
+
+    # Memory-map the recording file and yield each scan in it as an array of samples, paired with the time at which it
+    # was recorded
+    def __iter__(self):
+        # Verify that the file has the expected header
+        with open(self.recording_path, 'rb') as recording_file:
+            if recording_file.read(len(RECORDING_HEADER)) != RECORDING_HEADER:
+                raise ValueError('{} is not a Sweep recording'.format(self.recording_path))
+        # Calculate the number of complete records in the file, ignoring any partial record at the end left behind if
+        # the recorder was stopped in the middle of a write
+        record_count = (os.path.getsize(self.recording_path) - len(RECORDING_HEADER)) // RECORD_DTYPE.itemsize
+        # If the recording is empty, there is nothing to play back
+        if record_count == 0:
+            return
+        # Map the records in the file without reading it into memory
+        records = np.memmap(self.recording_path, dtype=RECORD_DTYPE, mode='r', offset=len(RECORDING_HEADER),
+                            shape=(record_count,))
+
+        # Find the index of the first record of each scan, which is wherever the scan index changes
+        scan_starts = np.concatenate(([0], np.flatnonzero(np.diff(records['scan_index'])) + 1))
+        scan_ends = np.append(scan_starts[1:], len(records))
+
+        # Get the time at which the first scan was recorded and the time at which playback started
+        first_scan_time = records['timestamp'][0]
+        playback_start_time = time.time()
+
+        # Iterate over the start and end of each scan
+        for scan_start, scan_end in zip(scan_starts, scan_ends):
+            scan_records = records[scan_start:scan_end]
+
+            # If the playback is timed, wait until the scan's time relative to the start of the recording is reached
+            if self.speed is not None:
+                scan_playback_time = (scan_records['timestamp'][0] - first_scan_time) / self.speed
+                delay = playback_start_time + scan_playback_time - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+            # Copy the sample fields out of the records into an array of the same form as the live sensor produces
+            samples = np.empty(len(scan_records), dtype=SAMPLE_DTYPE)
+            for field_name in SAMPLE_DTYPE.names:
+                samples[field_name] = scan_records[field_name]
+            yield scan_records['timestamp'][0], samples.view(np.recarray)
@@ -1,42 +1,205 @@
 #!/usr/bin/python3
 
+import argparse
+import array
 import os
 import sys
+import time
+
+import numpy as np
 
 # Script to parse a log file produced by the new deep Q-network training system, outputting the maximum score, corresponding rolling average squared error and loss, episode number, and epsilon
+# It can also follow a log while training is still running, printing the best episode whenever it changes
+# All of the episodes can also be exported to a columnar NumPy archive beside the log, which is reused as a cache for queries over every episode
 # Created by brendon-ai, May 2018
 
-# Verify that the number of command line arguments is correct
-if len(sys.argv) != 2:
-    print('Usage:', sys.argv[0], '<log file path>')
+# The default number of seconds between checks for new lines when following a log
+FOLLOW_INTERVAL_SECONDS = 2
+
+# The names of the values parsed for every episode, in the order in which they appear in a data tuple, along with the array type codes used to collect them
+EPISODE_COLUMNS = ('squared_error', 'loss', 'episode', 'score', 'epsilon')
+EPISODE_COLUMN_TYPE_CODES = ('d', 'd', 'q', 'q', 'd')
+
+# The suffix added to the log's path to get the path of the exported episode archive
+EXPORT_SUFFIX = '.episodes.npz'
+
+# The default width of the epsilon ranges that episodes are grouped into for per-epsilon statistics
+EPSILON_BIN_WIDTH = 0.1
+
+
+# A parser that is fed the log one line at a time, pairing each line containing the squared error and loss with the following line containing the episode number, score, and epsilon, and keeping only the data of the best episode so far
+class MaxScoreParser:
+    # The words of the previous line if it contained the squared error and loss, or None otherwise
+    error_line_words = None
+
+    # The tuple of data corresponding to the maximum score so far, or None if no episodes have been parsed
+    max_score_data_tuple = None
+
+    # Tokenize a single line and update the maximum score if it completes an episode
+    def feed_line(self, line):
+        words = line.split()
+        # If the previous line contained the squared error and loss and this line contains the episode number, parse both
+        if self.error_line_words is not None and words and words[0] == 'episode:':
+            # Parse the rolling average squared error and loss
+            squared_error = float(self.error_line_words[8])
+            loss = float(self.error_line_words[13])
+            # Parse the episode number, score, and epsilon
+            episode = int(words[1].split('/')[0])
+            score = int(words[3][:-1])
+            epsilon = float(words[5])
+            # Package each of these values into a tuple and add it to the record
+            self.add_episode((squared_error, loss, episode, score, epsilon))
+        # Remember this line's words if it contains the squared error and loss, so they can be paired with the next line
+        self.error_line_words = words if words and words[0] == 'Over' else None
+
+    # Keep an episode's data tuple if its score is higher than any before it
+    def add_episode(self, data_tuple):
+        if self.max_score_data_tuple is None or data_tuple[3] > self.max_score_data_tuple[3]:
+            self.max_score_data_tuple = data_tuple
+
+
+# A parser that also keeps every episode's values, in compact typed arrays with one per column
+class EpisodeColumnParser(MaxScoreParser):
+    # Create an empty array for each column
+    def __init__(self):
+        self.columns = [array.array(type_code) for type_code in EPISODE_COLUMN_TYPE_CODES]
+
+    # Append each of the episode's values to its column, as well as keeping track of the maximum score
+    def add_episode(self, data_tuple):
+        super(EpisodeColumnParser, self).add_episode(data_tuple)
+        for column, value in zip(self.columns, data_tuple):
+            column.append(value)
+
+
+# Load every episode in a log as a dictionary of NumPy arrays keyed by column name, using the exported archive beside the log if it was created from a log of the same size and modification time, and parsing the log and exporting it otherwise
+# Also return whether the archive beside the log is up to date, which is not the case if it could not be written
+def load_episode_columns(log_path):
+    log_stat = os.stat(log_path)
+    export_path = log_path + EXPORT_SUFFIX
+    # Try to use the archive if it exists and matches the log
+    try:
+        with np.load(export_path) as archive:
+            if archive['log_size'] == log_stat.st_size and archive['log_mtime'] == log_stat.st_mtime_ns:
+                return {column: archive[column] for column in EPISODE_COLUMNS}, True
+    except (OSError, ValueError, KeyError):
+        pass
+
+    # Otherwise, parse the whole log and convert the columns to NumPy arrays
+    parser = EpisodeColumnParser()
+    with open(log_path) as log_file:
+        for line in log_file:
+            parser.feed_line(line)
+    columns = {column: np.frombuffer(values, dtype=values.typecode) for column, values in zip(EPISODE_COLUMNS, parser.columns)}
+    # Save them along with the size and modification time of the log through a temporary file, as the other caches beside their inputs are saved, and carry on without the archive if it cannot be written
+    temporary_path = export_path[:-len('.npz')] + '.{}.tmp.npz'.format(os.getpid())
+    try:
+        np.savez(temporary_path, log_size=log_stat.st_size, log_mtime=log_stat.st_mtime_ns, **columns)
+        os.replace(temporary_path, export_path)
+    except OSError:
+        # Remove the temporary file if it was written but could not be moved into place
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
+        return columns, False
+    return columns, True
+
+
+# Parse the complete lines that have been added to a log since the provided byte offset, returning the offset just past the last complete line, so that a line that is still being written is parsed once it is finished
+def parse_new_lines(parser, log_path, offset):
+    with open(log_path, 'rb') as log_file:
+        log_file.seek(offset)
+        # Read one line at a time so that only the current line is kept in memory, even on the first pass over a large log
+        for line in log_file:
+            # Stop at a final line that is still being written, so that it is parsed once it is finished
+            if not line.endswith(b'\n'):
+                break
+            parser.feed_line(line.decode(errors='replace'))
+            offset += len(line)
+    return offset
+
+
+# Format the data corresponding to the maximum score for printing
+def format_max_score(max_score_data_tuple):
+    return 'Squared error: {}, loss: {}, episode: {}, score, {}, epsilon: {}'.format(*max_score_data_tuple)
+
+
+# Parse the command line arguments
+argument_parser = argparse.ArgumentParser(description='Find the episode with the maximum score in a deep Q training log.')
+argument_parser.add_argument('log_path', metavar='log file path')
+argument_parser.add_argument('--follow', action='store_true', help='keep parsing the log as it grows, printing the best episode whenever it changes')
+argument_parser.add_argument('--export', action='store_true', help='export every episode to a NumPy archive beside the log (done automatically by the queries below)')
+argument_parser.add_argument('--top', type=int, metavar='K', help='print the K episodes with the highest scores')
+argument_parser.add_argument('--by-epsilon', action='store_true', help='print score statistics for episodes grouped by epsilon')
+argument_parser.add_argument('--epsilon-bin-width', type=float, default=EPSILON_BIN_WIDTH, help='width of the epsilon groups (default: %(default)s)')
+argument_parser.add_argument('--plot', action='store_true', help='plot the score of every episode')
+argument_parser.add_argument('--interval', type=float, default=FOLLOW_INTERVAL_SECONDS, help='seconds between checks for new lines when following (default: %(default)s)')
+arguments = argument_parser.parse_args()
+log_path = os.path.expanduser(arguments.log_path)
+
+# If following was requested, parse the log incrementally from the last byte offset until the script is interrupted
+if arguments.follow:
+    parser = MaxScoreParser()
+    offset = 0
+    try:
+        while True:
+            # If the log is now shorter than the offset, it has been replaced, so start over from the beginning
+            if os.path.getsize(log_path) < offset:
+                parser = MaxScoreParser()
+                offset = 0
+            # Parse the new lines, and print the best episode if it has changed
+            previous_max_score_data_tuple = parser.max_score_data_tuple
+            offset = parse_new_lines(parser, log_path, offset)
+            if parser.max_score_data_tuple != previous_max_score_data_tuple:
+                print(format_max_score(parser.max_score_data_tuple), flush=True)
+            time.sleep(arguments.interval)
+    except KeyboardInterrupt:
+        sys.exit()
+
+# If the export or any queries over all of the episodes were requested, load the episode columns and answer them using whole-array operations
+if arguments.export or arguments.top or arguments.by_epsilon or arguments.plot:
+    columns, exported = load_episode_columns(log_path)
+    if arguments.export:
+        if exported:
+            print('Exported', len(columns['score']), 'episodes to', log_path + EXPORT_SUFFIX)
+        else:
+            print('Failed to export episodes to', log_path + EXPORT_SUFFIX)
+
+    # Print the episodes with the highest scores, highest first
+    if arguments.top:
+        for index in np.argsort(-columns['score'], kind='stable')[:arguments.top]:
+            print(format_max_score(tuple(columns[column][index] for column in EPISODE_COLUMNS)))
+
+    # Print the number of episodes and the mean and maximum score for each range of epsilon values
+    if arguments.by_epsilon:
+        bins = np.floor(columns['epsilon'] / arguments.epsilon_bin_width).astype(np.int64)
+        unique_bins, bin_indices, bin_counts = np.unique(bins, return_inverse=True, return_counts=True)
+        score_sums = np.bincount(bin_indices, weights=columns['score'])
+        score_maximums = np.full(len(unique_bins), np.iinfo(np.int64).min)
+        np.maximum.at(score_maximums, bin_indices, columns['score'])
+        for epsilon_bin, count, score_sum, score_maximum in zip(unique_bins, bin_counts, score_sums, score_maximums):
+            print('Epsilon {:.3f} to {:.3f}: {} episodes, mean score: {:.2f}, max score: {}'.format(
+                epsilon_bin * arguments.epsilon_bin_width, (epsilon_bin + 1) * arguments.epsilon_bin_width, count,
+                score_sum / count, score_maximum))
+
+    # Plot the score of every episode
+    if arguments.plot:
+        # Import the plotting library only when it is needed, since logs are often parsed on machines without a display
+        import matplotlib.pyplot as plt
+        plt.figure('Deep Q Training Scores')
+        plt.plot(columns['episode'], columns['score'])
+        plt.xlabel('Episode')
+        plt.ylabel('Score')
+        plt.show()
     sys.exit()
 
-# Get the full path to the log file and read its contents
-log_path = os.path.expanduser(sys.argv[1])
+# Get the full path to the log file and feed it through the parser one line at a time, so that only the current line and the best episode are kept in memory
+parser = MaxScoreParser()
 with open(log_path) as log_file:
-    log_lines = log_file.readlines()
-
-# Create a list to hold tuples of data from the file
-data_tuples = []
-# Iterate over the log's length, getting the words in the line containing the squared error and loss and also the index of the line containing the episode number, score, and epsilon
-for error_line_index in range(len(log_lines) - 1):
-    error_line_words = log_lines[error_line_index].split()
-    episode_line_index = error_line_index + 1
-    episode_line_words = log_lines[episode_line_index].split()
-    # Verify that the current line and the next line are in the expected format; skip to the next iteration otherwise
-    if error_line_words[0] != 'Over' or episode_line_words[0] != 'episode:':
-        continue
-    # Parse the rolling average squared error and loss
-    squared_error = float(error_line_words[8])
-    loss = float(error_line_words[13])
-    # Parse the episode number, score, and epsilon
-    episode = int(episode_line_words[1].split('/')[0])
-    score = int(episode_line_words[3][:-1])
-    epsilon = float(episode_line_words[5])
-    # Package each of these values into a tuple and add it to the list
-    data_tuples.append((squared_error, loss, episode, score, epsilon))
-
-# Get the data corresponding to the maximum score and print it out
-max_score_data_tuple = max(data_tuples, key=lambda data_tuple: data_tuple[3])
-print('Squared error: {}, loss: {}, episode: {}, score, {}, epsilon: {}'
-      .format(*max_score_data_tuple))
+    for line in log_file:
+        parser.feed_line(line)
+
+# Print out the data corresponding to the maximum score
+if parser.max_score_data_tuple is None:
+    sys.exit('No episodes found in the log')
+print(format_max_score(parser.max_score_data_tuple))
@@ -1,22 +1,327 @@
 #!/usr/bin/env python3
 
+import argparse
+import collections
+import os
+import re
+import sys
+
+import numpy as np
+
 
 # A script for parsing the raw training output data files generated when training a reinforcement learning model, and
 # calculating the average time on the road during the first 500 iterations
+# It reads any amount of piped or file input in constant memory, skipping malformed lines, and can also report
+# statistics over the whole run, a sliding window at the end of the run, and consecutive blocks of iterations
+# A bulk mode parses large files in chunks with NumPy and caches the parsed times beside the file
+
+
+# The default number of iterations at the start of the run that the original mean is calculated over
+FIRST_ITERATION_COUNT = 500
+
+# The default percentiles reported for each group of iterations
+PERCENTILES = (50, 90, 99)
 
+# The number of bytes read at once in bulk mode
+BULK_CHUNK_SIZE = 16 * 1024 * 1024
 
-# The list that will contain the times before failure
-times_before_failure = []
+# A regular expression matching the same lines as parse_time_before_failure, capturing element 3 without its last
+# character, so that a whole chunk of input can be parsed in a single call
+TIME_BEFORE_FAILURE_PATTERN = re.compile(
+    rb'^[^\S\n]*\S+[^\S\n]+\S+[^\S\n]+\S+[^\S\n]+([+-]?\d+)\S(?:[^\S\n]|$)', re.MULTILINE)
 
-# For the first 500 lines
-for _ in range(500):
-    # Get the line passed as standard input (the file should be piped to this script)
-    line = input()
+# The suffix added to the input file's path to get the path of the cache of parsed times
+BULK_CACHE_SUFFIX = '.times.npz'
+
+
+# Parse the time spent before failure from a line, returning None if the line is not in the expected format
+def parse_time_before_failure(line):
     # Split the line by whitespace and parse element 3 (with the ending comma removed) as an integer
-    # This is the time spent before failure
-    time_before_failure = int(line.split()[3][:-1])
-    # Add it to the list
-    times_before_failure.append(time_before_failure)
+    words = line.split()
+    try:
+        return int(words[3][:-1])
+    except (IndexError, ValueError):
+        return None
+
+
+# Calculate a percentile of a sorted list by linear interpolation between the closest ranks
+def exact_percentile(sorted_values, percentile):
+    position = (len(sorted_values) - 1) * percentile / 100
+    lower_index = int(position)
+    upper_index = min(lower_index + 1, len(sorted_values) - 1)
+    fraction = position - lower_index
+    return sorted_values[lower_index] + (sorted_values[upper_index] - sorted_values[lower_index]) * fraction
+
+
+# Format the count, mean, minimum, maximum, and percentiles of a group of values as a single line
+def format_statistics(name, count, mean, minimum, maximum, percentile_values):
+    return '{}: {} iterations, mean: {:.2f}, min: {}, max: {}, {}'.format(
+        name, count, mean, minimum, maximum,
+        ', '.join('p{}: {:.1f}'.format(percentile, value) for percentile, value in percentile_values)
+    )
+
+
+# Summarize a bounded list of values exactly
+def summarize_values(name, values, percentiles):
+    sorted_values = sorted(values)
+    return format_statistics(
+        name, len(values), sum(values) / len(values), sorted_values[0], sorted_values[-1],
+        [(percentile, exact_percentile(sorted_values, percentile)) for percentile in percentiles]
+    )
+
+
+# An estimator of a single percentile of a stream of values in constant memory, using the P-squared algorithm, which
+# keeps five markers whose heights are adjusted towards the minimum, the percentile, its neighbors, and the maximum
+class P2Percentile:
+    # Store the percentile as a fraction and the first values, which are used to initialize the markers
+    def __init__(self, percentile):
+        self.fraction = percentile / 100
+        self.initial_values = []
+        # The heights and positions of the markers, and the desired positions and their increments
+        self.heights = None
+        self.positions = None
+        self.desired_positions = None
+        self.desired_increments = [0, self.fraction / 2, self.fraction, (1 + self.fraction) / 2, 1]
+
+    # Add a value to the stream
+    def add(self, value):
+        # Until there are five values, just collect them, and then initialize the markers from them
+        if self.heights is None:
+            self.initial_values.append(value)
+            if len(self.initial_values) == 5:
+                self.heights = sorted(self.initial_values)
+                self.positions = [0, 1, 2, 3, 4]
+                self.desired_positions = [0, 2 * self.fraction, 4 * self.fraction, 2 + 2 * self.fraction, 4]
+            return
+
+        # Find the cell that the value falls in, extending the minimum or maximum if it is outside of them
+        heights = self.heights
+        if value < heights[0]:
+            heights[0] = value
+            cell = 0
+        elif value >= heights[4]:
+            heights[4] = value
+            cell = 3
+        else:
+            cell = next(index for index in range(1, 5) if value < heights[index]) - 1
+
+        # Shift the markers above the cell, and advance the desired positions
+        for index in range(cell + 1, 5):
+            self.positions[index] += 1
+        for index in range(5):
+            self.desired_positions[index] += self.desired_increments[index]
+
+        # Move each of the middle markers by one position if it is far enough from its desired position
+        positions = self.positions
+        for index in range(1, 4):
+            offset = self.desired_positions[index] - positions[index]
+            if (offset >= 1 and positions[index + 1] - positions[index] > 1) or \
+                    (offset <= -1 and positions[index - 1] - positions[index] < -1):
+                step = 1 if offset > 0 else -1
+                # Try a parabolic prediction of the new height, and use a linear one if it is out of order
+                parabolic_height = heights[index] + step / (positions[index + 1] - positions[index - 1]) * (
+                    (positions[index] - positions[index - 1] + step) * (heights[index + 1] - heights[index])
+                    / (positions[index + 1] - positions[index])
+                    + (positions[index + 1] - positions[index] - step) * (heights[index] - heights[index - 1])
+                    / (positions[index] - positions[index - 1])
+                )
+                if heights[index - 1] < parabolic_height < heights[index + 1]:
+                    heights[index] = parabolic_height
+                else:
+                    heights[index] += step * (heights[index + step] - heights[index]) / \
+                        (positions[index + step] - positions[index])
+                positions[index] += step
+
+    # Get the current estimate of the percentile, which is exact while there are fewer than five values
+    def value(self):
+        if self.heights is None:
+            return exact_percentile(sorted(self.initial_values), self.fraction * 100)
+        return self.heights[2]
+
+
+# Parse every time before failure from a binary file in large chunks, returning an array of the times and the number of
+# malformed lines
+def bulk_parse(binary_file):
+    time_arrays = []
+    line_count = 0
+    remainder = b''
+    while True:
+        chunk = binary_file.read(BULK_CHUNK_SIZE)
+        # Only parse up to the end of the last complete line, carrying the rest over to the next chunk
+        if chunk:
+            data = remainder + chunk
+            complete_length = data.rfind(b'\n') + 1
+            data, remainder = data[:complete_length], data[complete_length:]
+        # At the end of the file, parse whatever partial line is left over
+        else:
+            data, remainder = remainder, b''
+        if data:
+            # Extract the column from every line in the chunk at once and convert it to integers in a single step
+            matches = TIME_BEFORE_FAILURE_PATTERN.findall(data)
+            time_arrays.append(np.array(matches, dtype=bytes).astype(np.int64) if matches else
+                               np.empty(0, dtype=np.int64))
+            line_count += data.count(b'\n') + (not data.endswith(b'\n'))
+        if not chunk:
+            break
+    times = np.concatenate(time_arrays) if time_arrays else np.empty(0, dtype=np.int64)
+    return times, line_count - len(times)
+
+
+# Load the times before failure from a file in bulk, using the cache beside it if it was created from a file of the
+# same size and modification time, and parsing the file and saving the cache otherwise
+def bulk_load(input_path):
+    input_stat = os.stat(input_path)
+    cache_path = input_path + BULK_CACHE_SUFFIX
+    try:
+        with np.load(cache_path) as cache:
+            if cache['input_size'] == input_stat.st_size and cache['input_mtime'] == input_stat.st_mtime_ns:
+                return cache['times'], int(cache['malformed_line_count'])
+    except (OSError, ValueError, KeyError):
+        pass
+    with open(input_path, 'rb') as input_file:
+        times, malformed_line_count = bulk_parse(input_file)
+    # Save the cache through a temporary file, and carry on without it if it cannot be written
+    temporary_path = cache_path[:-len('.npz')] + '.{}.tmp.npz'.format(os.getpid())
+    try:
+        np.savez(temporary_path, input_size=input_stat.st_size, input_mtime=input_stat.st_mtime_ns, times=times,
+                 malformed_line_count=malformed_line_count)
+        os.replace(temporary_path, cache_path)
+    except OSError:
+        # Remove the temporary file if it was written but could not be moved into place
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
+    return times, malformed_line_count
+
+
+# Summarize an array of values exactly using whole-array operations
+def summarize_array(name, values, percentiles):
+    return format_statistics(
+        name, len(values), values.mean(), values.min(), values.max(),
+        list(zip(percentiles, np.percentile(values, percentiles)))
+    )
+
+
+# Running statistics over a whole stream of values, using constant memory
+class StreamStatistics:
+    # The number of values, their sum, and the lowest and highest values
+    count = 0
+    total = 0
+    minimum = None
+    maximum = None
+
+    # Create an estimator for each of the percentiles
+    def __init__(self, percentiles):
+        self.percentile_estimators = [(percentile, P2Percentile(percentile)) for percentile in percentiles]
+
+    # Add a value to the statistics
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.minimum = value if self.minimum is None else min(self.minimum, value)
+        self.maximum = value if self.maximum is None else max(self.maximum, value)
+        for _, estimator in self.percentile_estimators:
+            estimator.add(value)
+
+    # Format the statistics as a single line
+    def summary(self, name):
+        return format_statistics(
+            name, self.count, self.total / self.count, self.minimum, self.maximum,
+            [(percentile, estimator.value()) for percentile, estimator in self.percentile_estimators]
+        )
+
+
+# Parse the command line arguments
+parser = argparse.ArgumentParser(description='Calculate statistics of the time before failure during training.')
+parser.add_argument('input', nargs='?', type=argparse.FileType('r'), default=sys.stdin,
+                    help='training output file (default: standard input)')
+parser.add_argument('--first', type=int, default=FIRST_ITERATION_COUNT,
+                    help='number of iterations at the start of the run to summarize (default: %(default)s)')
+parser.add_argument('--window', type=int, help='also summarize a sliding window of this many iterations at the end')
+parser.add_argument('--block', type=int, help='also summarize each consecutive block of this many iterations')
+parser.add_argument('--percentiles', type=float, nargs='+', default=PERCENTILES,
+                    help='percentiles to report (default: %(default)s)')
+parser.add_argument('--all', action='store_true', help='also summarize the whole run')
+parser.add_argument('--bulk', action='store_true',
+                    help='parse the input in large chunks with NumPy, caching the result beside an input file')
+arguments = parser.parse_args()
+
+# If bulk mode was requested, load the times as an array and print every summary with whole-array operations
+if arguments.bulk:
+    # Use the cache if the input is a file, and parse standard input directly otherwise
+    if arguments.input is sys.stdin:
+        times, malformed_line_count = bulk_parse(sys.stdin.buffer)
+    else:
+        arguments.input.close()
+        times, malformed_line_count = bulk_load(arguments.input.name)
+    if not len(times):
+        sys.exit('No valid lines found')
+
+    # Print each complete block and then the partial block at the end, if there is one
+    if arguments.block:
+        for block_index, block_start in enumerate(range(0, len(times), arguments.block)):
+            block_times = times[block_start:block_start + arguments.block]
+            name = 'Block {}'.format(block_index) if len(block_times) == arguments.block else \
+                'Block {} (partial)'.format(block_index)
+            print(summarize_array(name, block_times, arguments.percentiles))
+
+    # Print the same summaries as the streaming mode, with exact percentiles for the whole run
+    first_times = times[:arguments.first]
+    print('Mean time before failure:', first_times.mean())
+    print(summarize_array('First {}'.format(len(first_times)), first_times, arguments.percentiles))
+    if arguments.window:
+        window_times = times[-arguments.window:]
+        print(summarize_array('Last {}'.format(len(window_times)), window_times, arguments.percentiles))
+    if arguments.all:
+        print(summarize_array('Whole run', times, arguments.percentiles))
+    if malformed_line_count:
+        print('Skipped', malformed_line_count, 'malformed lines')
+    sys.exit()
+
+# The times before failure of the first iterations, the latest iterations, and the current block, each bounded in size
+first_times = []
+window_times = collections.deque(maxlen=arguments.window)
+block_times = []
+
+# The statistics over the whole run, and the number of lines that could not be parsed
+whole_run_statistics = StreamStatistics(arguments.percentiles)
+malformed_line_count = 0
+
+# Iterate over the input one line at a time
+block_index = 0
+for line in arguments.input:
+    # Parse the time spent before failure, skipping the line if it is malformed
+    time_before_failure = parse_time_before_failure(line)
+    if time_before_failure is None:
+        malformed_line_count += 1
+        continue
+
+    # Add it to each of the groups of iterations
+    if len(first_times) < arguments.first:
+        first_times.append(time_before_failure)
+    if arguments.window:
+        window_times.append(time_before_failure)
+    if arguments.all:
+        whole_run_statistics.add(time_before_failure)
+    if arguments.block:
+        block_times.append(time_before_failure)
+        # When a block is complete, print it out and start the next one
+        if len(block_times) == arguments.block:
+            print(summarize_values('Block {}'.format(block_index), block_times, arguments.percentiles))
+            block_times = []
+            block_index += 1
 
-# Print the mean of the list
-print('Mean time before failure:', sum(times_before_failure) / len(times_before_failure))
+# Print the mean of the first iterations in the original format, followed by the other summaries
+if not first_times:
+    sys.exit('No valid lines found')
+print('Mean time before failure:', sum(first_times) / len(first_times))
+print(summarize_values('First {}'.format(len(first_times)), first_times, arguments.percentiles))
+if block_times:
+    print(summarize_values('Block {} (partial)'.format(block_index), block_times, arguments.percentiles))
+if window_times:
+    print(summarize_values('Last {}'.format(len(window_times)), window_times, arguments.percentiles))
+if arguments.all:
+    print(whole_run_statistics.summary('Whole run (percentiles estimated)'))
+if malformed_line_count:
+    print('Skipped', malformed_line_count, 'malformed lines')
@@ -1,59 +1,228 @@
 #!/usr/bin/env python3
 
+import argparse
+import bisect
+import fcntl
+import json
+import math
 import os
 import shutil
-import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # A simple script to copy items in a folder into one of two subfolders,
 # depending on whether they were created before or after a given time
+# It can also split the folder into many time windows, using several thresholds or buckets of a fixed width
+# Every file placed is recorded in a manifest, so that files which have already been placed are skipped on later runs
 # Created by brendon-ai, September 2017
 
 
-# Names of directories to move files into
+# Names of directories to move files into when there is a single threshold
 SUBFOLDER_NAMES = ('before', 'after')
 
-# Verify that the number of command line arguments is correct
-if len(sys.argv) != 3:
-    print('Usage: {} <image folder> <threshold Unix time>'.format(sys.argv[0]))
-    sys.exit()
+# The ways in which files can be placed into the subfolders
+STRATEGIES = ('copy', 'hardlink', 'reflink', 'move')
+
+# The ioctl request number used to make a copy-on-write clone of a file on Linux (FICLONE)
+FICLONE = 0x40049409
+
+# The number of files placed between progress updates
+PROGRESS_INTERVAL = 1000
+
+# The name of the manifest file kept in the main folder, which contains one JSON object per line for every file placed
+MANIFEST_FILE_NAME = '.separate_dataset_manifest'
+
+
+# Remove a previous placement of a file, since it may be a hard link to the file itself, which would be truncated by
+# writing over it, and a link cannot replace an existing file
+def remove_destination(destination_path):
+    if os.path.lexists(destination_path):
+        os.remove(destination_path)
+
+
+# Clone a file using a copy-on-write reflink, falling back to a full copy if the file system does not support it
+def reflink(file_path, destination_path):
+    remove_destination(destination_path)
+    try:
+        with open(file_path, 'rb') as source_file, open(destination_path, 'wb') as destination_file:
+            fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+        shutil.copymode(file_path, destination_path)
+    except OSError:
+        shutil.copy(file_path, destination_path)
+
+
+# Create a hard link to a file, falling back to a full copy if it is on a different device or links are not supported
+def hardlink(file_path, destination_path):
+    remove_destination(destination_path)
+    try:
+        os.link(file_path, destination_path)
+    except OSError:
+        shutil.copy(file_path, destination_path)
+
+
+# Place a file in a destination folder using the provided strategy, removing the copy or link of it from the folder it
+# was previously placed in, if any, so that the file does not end up in two windows
+def place_file(file_path, destination_folder, strategy, previous_folder=None):
+    destination_path = os.path.join(destination_folder, os.path.basename(file_path))
+    if previous_folder is not None and previous_folder != destination_folder:
+        previous_path = os.path.join(previous_folder, os.path.basename(file_path))
+        if os.path.lexists(previous_path):
+            os.remove(previous_path)
+    if strategy == 'copy':
+        remove_destination(destination_path)
+        shutil.copy(file_path, destination_path)
+    elif strategy == 'hardlink':
+        hardlink(file_path, destination_path)
+    elif strategy == 'reflink':
+        reflink(file_path, destination_path)
+    else:
+        shutil.move(file_path, destination_path)
+
+
+# Format a Unix time for use in a folder name, without any unnecessary trailing zeros
+def format_time(unix_time):
+    return '{:f}'.format(unix_time).rstrip('0').rstrip('.')
+
+
+# Get the names of the subfolders for the windows between a sorted list of thresholds
+def threshold_subfolder_names(thresholds):
+    # A single threshold uses the original before and after names
+    if len(thresholds) == 1:
+        return list(SUBFOLDER_NAMES)
+    # Otherwise, name each window after the thresholds on either side of it
+    formatted_thresholds = [format_time(threshold) for threshold in thresholds]
+    return (['before_' + formatted_thresholds[0]]
+            + ['{}_to_{}'.format(start, end) for start, end in zip(formatted_thresholds, formatted_thresholds[1:])]
+            + ['after_' + formatted_thresholds[-1]])
+
+
+# Load the manifest from a folder as a dictionary from file names to the size, modification time, and subfolder name
+# with which each file was placed, or an empty dictionary if there is no manifest yet
+def load_manifest(manifest_path):
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as manifest_file:
+            for line in manifest_file:
+                # Skip any partial line left behind if a previous run was stopped in the middle of writing it
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                # Later records replace earlier ones for the same file
+                manifest[record['name']] = (record['size'], record['mtime'], record['destination'])
+    return manifest
+
+
+# Parse the command line arguments
+parser = argparse.ArgumentParser(description='Separate the files in a folder by modification time.')
+parser.add_argument('folder', help='image folder')
+parser.add_argument('threshold_times', type=float, nargs='*', metavar='threshold_time',
+                    help='threshold Unix times; files are separated into the windows between them')
+parser.add_argument('--bucket-width', type=float,
+                    help='separate files into windows of this many seconds instead of using thresholds')
+parser.add_argument('--bucket-start', type=float,
+                    help='Unix time at which the first bucket starts (default: the earliest modification time)')
+parser.add_argument('--strategy', choices=STRATEGIES, default='copy',
+                    help='how files are placed in the subfolders (default: copy)')
+parser.add_argument('--threads', type=int, default=os.cpu_count(),
+                    help='number of files placed in parallel (default: number of CPUs)')
+arguments = parser.parse_args()
+
+# Exactly one of thresholds or a bucket width must be provided
+if bool(arguments.threshold_times) == (arguments.bucket_width is not None):
+    parser.error('provide either one or more threshold times or a bucket width')
+if arguments.bucket_width is not None and arguments.bucket_width <= 0:
+    parser.error('the bucket width must be positive')
 
 # Get a folder from the first command line argument
-folder = os.path.expanduser(sys.argv[1])
-
-# Get a Unix time value from the second argument
-threshold_time = float(sys.argv[2])
-
-# List for the full paths of the subfolders that will be created
-subfolders = []
-
-# Create a before directory and an after directory
-for subfolder in SUBFOLDER_NAMES:
-
-    # Format the full path
-    subfolder_path = os.path.join(folder, subfolder)
-
-    # Create the folder if it does not exist
-    if not os.path.exists(subfolder_path):
-        os.makedirs(subfolder_path)
-
-    # Also add the folder's path to a list
-    subfolders.append(subfolder_path)
-
-# For each of the files in the main folder
-for file_name in os.listdir(folder):
-
-    # Format the file's full path
-    file_path = os.path.join(folder, file_name)
-
-    # If it is a file and not a folder
-    if os.path.isfile(file_path):
-
-        # If the file's modification time is lower than the provided time
-        if os.path.getmtime(file_path) < threshold_time:
-
-            # Copy the file to the before subfolder
-            shutil.copy(file_path, subfolders[0])
-
-        # Otherwise copy it to the after subfolder
+folder = os.path.expanduser(arguments.folder)
+
+# List of tuples of the paths, sizes, and modification times of the files in the folder
+files = []
+
+# For each of the entries in the main folder, in a single pass that reuses the information from the directory listing
+with os.scandir(folder) as entries:
+    for entry in entries:
+
+        # If it is a file and not a folder (or the manifest), record its path, size, and modification time
+        if entry.is_file() and entry.name != MANIFEST_FILE_NAME:
+            entry_stat = entry.stat()
+            files.append((entry.path, entry_stat.st_size, entry_stat.st_mtime))
+
+# List of the names of the subfolders that each file will be placed in, in the same order as the files
+file_subfolder_names = []
+
+# If thresholds were provided, assign each file to the window between the thresholds that contains its modification
+# time, using a binary search over the sorted thresholds
+if arguments.threshold_times:
+    thresholds = sorted(arguments.threshold_times)
+    subfolder_names = threshold_subfolder_names(thresholds)
+    # Create all of the windows' subfolders, even if some of them end up empty
+    for subfolder in subfolder_names:
+        os.makedirs(os.path.join(folder, subfolder), exist_ok=True)
+    for _, _, modification_time in files:
+        # A file whose modification time is equal to a threshold belongs to the window after it
+        file_subfolder_names.append(subfolder_names[bisect.bisect_right(thresholds, modification_time)])
+
+# Otherwise, assign each file to a fixed-width bucket, named after the time at which the bucket starts
+else:
+    bucket_width = arguments.bucket_width
+    # If no start time was provided, start the first bucket at the earliest modification time
+    bucket_start = arguments.bucket_start
+    if bucket_start is None:
+        bucket_start = min((modification_time for _, _, modification_time in files), default=0)
+    for _, _, modification_time in files:
+        # Files from before the first bucket are placed together
+        if modification_time < bucket_start:
+            file_subfolder_names.append('before_' + format_time(bucket_start))
         else:
-            shutil.copy(file_path, subfolders[1])
+            bucket_index = math.floor((modification_time - bucket_start) / bucket_width)
+            file_subfolder_names.append('bucket_' + format_time(bucket_start + bucket_index * bucket_width))
+
+    # Create the subfolder of every bucket that contains files
+    for subfolder in set(file_subfolder_names):
+        os.makedirs(os.path.join(folder, subfolder), exist_ok=True)
+
+# Load the manifest of files placed by previous runs
+manifest_path = os.path.join(folder, MANIFEST_FILE_NAME)
+manifest = load_manifest(manifest_path)
+
+# List of the files that still need to be placed, along with the subfolders they should be placed in and the subfolders
+# they were previously placed in (or None), skipping those that were already placed in the same subfolder and have not
+# changed since
+placements = []
+for (file_path, size, modification_time), subfolder in zip(files, file_subfolder_names):
+    previous_record = manifest.get(os.path.basename(file_path))
+    if previous_record != (size, modification_time, subfolder):
+        previous_subfolder = previous_record[2] if previous_record is not None else None
+        placements.append((file_path, size, modification_time, subfolder, previous_subfolder))
+print('Skipping {} files that were already placed'.format(len(files) - len(placements)))
+
+# Place the files in their subfolders in parallel, recording each one in the manifest as soon as it has been placed
+# and printing the progress periodically
+with ThreadPoolExecutor(max_workers=arguments.threads) as executor, open(manifest_path, 'a') as manifest_file:
+    # Dictionary from the future of each file being placed to the corresponding placement
+    futures = {}
+    for placement in placements:
+        file_path, _, _, subfolder, previous_subfolder = placement
+        previous_folder = os.path.join(folder, previous_subfolder) if previous_subfolder is not None else None
+        future = executor.submit(place_file, file_path, os.path.join(folder, subfolder), arguments.strategy,
+                                 previous_folder)
+        futures[future] = placement
+    for files_placed, future in enumerate(as_completed(futures), 1):
+        # Raise any error that occurred while placing the file
+        future.result()
+        # Append a record of the file to the manifest
+        file_path, size, modification_time, subfolder, _ = futures[future]
+        manifest_file.write(json.dumps({
+            'name': os.path.basename(file_path),
+            'size': size,
+            'mtime': modification_time,
+            'destination': subfolder
+        }) + '\n')
+        if files_placed % PROGRESS_INTERVAL == 0 or files_placed == len(futures):
+            # Flush the manifest along with each progress update, so little work is repeated after an interruption
+            manifest_file.flush()
+            print('Placed {} of {} files'.format(files_placed, len(futures)), end='\r')
+
+# End the progress line
+print()
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 
+import argparse
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -20,101 +23,246 @@ ATTRIBUTE_NAMES = ['parameter', 'performance metric']
 # The number of X position steps used when calculating points on the polynomials for graphing
 POLYNOMIAL_STEP_COUNT = 50
 
-# Lists to hold the names and lists of elements of the parameter and performance metric
-names = []
-all_elements = []
+# The degrees of the polynomials fitted by default, which are a line and a parabola
+DEFAULT_DEGREES = [1, 2]
 
-# Prompt the user to enter the name and values of two attributes
-for attribute_name in ATTRIBUTE_NAMES:
-    # Prompt the user to enter the name of the parameter
-    print('Enter the name of the', attribute_name, 'to be plotted.')
-    name = input()
+# Names for polynomials of low degrees, used in the legend
+DEGREE_NAMES = {0: 'Constant', 1: 'Line', 2: 'Parabola', 3: 'Cubic'}
 
-    # Prompt the user to enter the list of values of the given parameter
-    print('Enter the values of the', attribute_name, 'with elements separated by newlines.')
-    print('End the list of values with a newline followed by an end-of-file character (control-D).')
-    elements = sys.stdin.readlines()
-
-    # Add the name and elements to corresponding lists
-    names.append(name)
-    all_elements.append(elements)
-
-# Strip whitespace from the names and elements
-names = [name.strip() for name in names]
-all_elements = [[element.strip() for element in elements] for elements in all_elements]
-
-# Try to convert all of the elements to numbers, skipping empty lines with zero length
-try:
-    all_elements_numeric = [[int_or_float(element) for element in elements if len(element)]
-                            for elements in all_elements]
-
-# If it fails, print an error message and exit
-except ValueError:
-    print('Non-numeric or incorrectly formatted input.')
-    sys.exit()
-
-# If the lengths of the two lists are different, exit with an error message
-if len(all_elements_numeric[0]) != len(all_elements_numeric[1]):
-    print('Unequal number of', ATTRIBUTE_NAMES[0], 'points and', ATTRIBUTE_NAMES[1], 'points.')
-    sys.exit()
-
-# Prompt the user to enter the title of the graph
-print('Enter the title of this graph.')
-title = input()
-
-# Set the title of the window
-plt.figure('Test Data Graphing Tool')
-
-# Set the title of the graph inside the window based on the user's input
-plt.title(title)
-
-# Plot a graph displaying the parameter and performance metric points, using square points
-plt.plot(*all_elements_numeric, 's', label='Data points')
-
-# Fit a line (degree 1) and a parabolic curve (degree 2) to the points
-polynomials = [np.polyfit(*all_elements_numeric, deg=degree) for degree in [1, 2]]
-
-# Get the first and last X positions of the data to use as outer bounds for the points on the polynomials
-data_x_positions = all_elements_numeric[0]
-min_x_position = min(data_x_positions)
-max_x_position = max(data_x_positions)
+# The maximum number of data points drawn on a graph by default; larger data sets are decimated before being drawn,
+# although the polynomials are still fitted to all of the points
+MAX_PLOTTED_POINTS = 5000
 
-# Calculate the step size to use based on the count and outer bounds
-polynomial_step_size = (max_x_position - min_x_position) / POLYNOMIAL_STEP_COUNT
+# The formats that graphs can be saved in when rendering files in batch mode
+OUTPUT_FORMATS = ('png', 'svg')
 
-# Generate descriptions for the legend corresponding to the polynomials
-descriptions = [name + ' of best fit' for name in ['Line', 'Parabola']]
 
-# Iterate over the polynomials and corresponding descriptions
-for polynomial, description in zip(polynomials, descriptions):
-
-    # Reverse the array of polynomial parameters so that the lowest order comes first
-    polynomial = np.flip(polynomial, 0)
-
-    # List of X and Y positions on the current polynomial
-    x_positions = []
-    y_positions = []
-
-    # Iterate over the X positions within the same range as the data, using the predefined step size
-    for x_position in np.arange(min_x_position, max_x_position, polynomial_step_size):
-        # For a polynomial of any order, calculate the Y position given the X position and polynomial parameters
-        y_position = sum([(x_position ** order) * polynomial[order] for order in range(len(polynomial))])
-
-        # Add both positions to their corresponding lists
-        x_positions.append(x_position)
-        y_positions.append(y_position)
-
-    # Plot the points in this polynomial, and label it with the description
-    plt.plot(x_positions, y_positions, label=description)
-
-# Display a legend on the plot
-plt.legend()
-
-# Set the X and Y labels to the provided parameter and performance metric names
-parameter_name, performance_metric_name = names
-plt.xlabel(parameter_name)
-plt.ylabel(performance_metric_name)
-
-# Notify the user and show the graph
-print('Opening the graph in a new window.')
-plt.show()
+# Prompt the user to enter a list of numeric values, each on a separate line, ending with an end-of-file character
+# Return None if any of them are not numbers
+def read_numeric_elements():
+    print('End the list of values with a newline followed by an end-of-file character (control-D).')
+    elements = [element.strip() for element in sys.stdin.readlines()]
+    # Try to convert all of the elements to numbers, skipping empty lines with zero length
+    try:
+        return [int_or_float(element) for element in elements if len(element)]
+    except ValueError:
+        return None
+
+
+# Get a description of a polynomial of the provided degree for the legend
+def describe_degree(degree):
+    return DEGREE_NAMES.get(degree, 'Degree {} polynomial'.format(degree)) + ' of best fit'
+
+
+# Fit polynomials of each of the provided degrees to the points, optionally weighting each point, and return a list
+# of tuples containing the degree, the coefficients (highest order first), the coefficient of determination (R
+# squared), and the root mean square of the residuals
+def fit_polynomials(x_values, y_values, degrees, weights=None):
+    x_values = np.asarray(x_values, dtype=np.float64)
+    y_values = np.asarray(y_values, dtype=np.float64)
+    # Squared weights are used in the statistics, since the fit minimizes the sum of the squared weighted residuals
+    squared_weights = np.ones_like(y_values) if weights is None else np.square(np.asarray(weights, dtype=np.float64))
+    weighted_mean = np.average(y_values, weights=squared_weights)
+    total_sum_of_squares = np.sum(squared_weights * np.square(y_values - weighted_mean))
+
+    fits = []
+    for degree in degrees:
+        coefficients = np.polyfit(x_values, y_values, deg=degree, w=weights)
+        # Evaluate the polynomial at every point at once to get the residuals
+        residuals = y_values - np.polyval(coefficients, x_values)
+        residual_sum_of_squares = np.sum(squared_weights * np.square(residuals))
+        r_squared = 1 - residual_sum_of_squares / total_sum_of_squares if total_sum_of_squares else 1.0
+        residual_rms = np.sqrt(np.mean(np.square(residuals)))
+        fits.append((degree, coefficients, r_squared, residual_rms))
+    return fits
+
+
+# Reduce a large set of points to at most approximately the provided number for drawing, by sorting them by X
+# position, dividing them into bins containing equal numbers of points, and keeping only the points with the minimum
+# and maximum Y values in each bin, so that the outline and outliers of the data are preserved
+def decimate_points(x_values, y_values, max_points):
+    x_values = np.asarray(x_values)
+    y_values = np.asarray(y_values)
+    if not max_points or len(x_values) <= max_points:
+        return x_values, y_values
+    # Two points are kept from each bin
+    bin_count = max(max_points // 2, 1)
+    order = np.argsort(x_values, kind='stable')
+    bin_boundaries = np.linspace(0, len(order), bin_count + 1).astype(np.int64)
+    bin_indices = np.repeat(np.arange(bin_count), np.diff(bin_boundaries))
+    # Sort by Y position within each bin, so that the first and last point in each bin are the minimum and maximum
+    order = order[np.lexsort((y_values[order], bin_indices))]
+    kept_indices = np.unique(np.concatenate((order[bin_boundaries[:-1]], order[bin_boundaries[1:] - 1])))
+    return x_values[kept_indices], y_values[kept_indices]
+
+
+# Plot the data points and the fitted polynomials on the current figure, drawing at most approximately the provided
+# number of points
+def plot_fits(x_values, y_values, fits, names, title, max_points=MAX_PLOTTED_POINTS):
+    # Set the title of the graph inside the window based on the user's input
+    plt.title(title)
+
+    # Plot a graph displaying the parameter and performance metric points, using square points, decimating them first
+    # if there are too many to draw quickly
+    plotted_x_values, plotted_y_values = decimate_points(x_values, y_values, max_points)
+    label = 'Data points'
+    if len(plotted_x_values) < len(x_values):
+        label += ' ({} of {} shown)'.format(len(plotted_x_values), len(x_values))
+    plt.plot(plotted_x_values, plotted_y_values, 's', label=label)
+
+    # Calculate the X positions within the same range as the data at which the polynomials are evaluated
+    x_positions = np.linspace(np.min(x_values), np.max(x_values), POLYNOMIAL_STEP_COUNT)
+
+    # Iterate over the polynomials, evaluating each one at all of the X positions at once and plotting it, labelled
+    # with a description and the coefficient of determination
+    for degree, coefficients, r_squared, _ in fits:
+        y_positions = np.polyval(coefficients, x_positions)
+        plt.plot(x_positions, y_positions, label='{} (R² = {:.4f})'.format(describe_degree(degree), r_squared))
+
+    # Display a legend on the plot
+    plt.legend()
+
+    # Set the X and Y labels to the provided parameter and performance metric names
+    parameter_name, performance_metric_name = names
+    plt.xlabel(parameter_name)
+    plt.ylabel(performance_metric_name)
+
+
+# Print out the coefficients and goodness of fit of each polynomial
+def print_fits(fits):
+    for degree, coefficients, r_squared, residual_rms in fits:
+        print('{}: coefficients (highest order first): {}, R squared: {}, residual RMS: {}'.format(
+            describe_degree(degree), ' '.join(str(coefficient) for coefficient in coefficients), r_squared,
+            residual_rms))
+
+
+# Load the points, optional weights, and attribute names from a data file, which is either a CSV file whose first line
+# contains the names of the columns, or a NumPy array file; in both cases, the columns are the parameter, the
+# performance metric, and optionally the weights
+def load_data_file(path):
+    if path.endswith('.npy'):
+        columns = np.load(path)
+        names = list(ATTRIBUTE_NAMES)
+    else:
+        with open(path) as data_file:
+            names = [name.strip() for name in data_file.readline().split(',')][:2]
+            columns = np.loadtxt(data_file, delimiter=',', ndmin=2)
+    weights = columns[:, 2] if columns.shape[1] > 2 else None
+    return columns[:, 0], columns[:, 1], weights, names
+
+
+# Get the names of the graphs of a list of data files, which are the names of the files without their extensions, unless
+# two files have the same name, in which case their paths relative to the folder containing all of the files are used,
+# with the path separators replaced by underscores; return None if the names are still not unique
+def graph_names(paths):
+    names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    if len(set(names)) < len(names):
+        absolute_paths = [os.path.abspath(path) for path in paths]
+        common_folder = os.path.commonpath([os.path.dirname(path) for path in absolute_paths])
+        names = [os.path.splitext(os.path.relpath(path, common_folder))[0].replace(os.sep, '_')
+                 for path in absolute_paths]
+    return names if len(set(names)) == len(names) else None
+
+
+# Fit polynomials to the data in a file and save the graph to the provided path without displaying it, returning the
+# path of the saved graph
+def render_data_file(path, output_path, degrees, max_points):
+    x_values, y_values, weights, names = load_data_file(path)
+    fits = fit_polynomials(x_values, y_values, degrees, weights)
+    # Use the name of the file without its extension as the title
+    title = os.path.splitext(os.path.basename(path))[0]
+    figure = plt.figure()
+    plot_fits(x_values, y_values, fits, names, title, max_points)
+    figure.savefig(output_path)
+    plt.close(figure)
+    return output_path
+
+
+# Render many data files, spread across a pool of processes, printing the path of each graph once it has been saved
+# Exit with an error if the graphs cannot be given distinct names, since they would overwrite each other
+def render_data_files(paths, output_folder, output_format, degrees, max_points, processes):
+    names = graph_names(paths)
+    if names is None:
+        sys.exit('The data files cannot be given distinct graph names; render files with the same name separately')
+    output_paths = [os.path.join(output_folder, '{}.{}'.format(name, output_format)) for name in names]
+    os.makedirs(output_folder, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=processes, initializer=plt.switch_backend, initargs=('Agg',)) as executor:
+        saved_paths = executor.map(render_data_file, paths, output_paths, [degrees] * len(paths),
+                                   [max_points] * len(paths))
+        for saved_path in saved_paths:
+            print('Saved', saved_path)
+
+
+if __name__ == '__main__':
+    # Parse the command line arguments
+    parser = argparse.ArgumentParser(description='Graph test data and fit polynomials to it.')
+    parser.add_argument('--degrees', type=int, nargs='+', default=DEFAULT_DEGREES,
+                        help='degrees of the polynomials to fit (default: 1 2)')
+    parser.add_argument('--weighted', action='store_true', help='prompt for a weight for each point, used in the fits')
+    parser.add_argument('--max-points', type=int, default=MAX_PLOTTED_POINTS,
+                        help='maximum number of data points drawn, above which they are decimated; 0 draws all of them '
+                             '(default: %(default)s)')
+    parser.add_argument('--files', nargs='+', metavar='DATA_FILE',
+                        help='render graphs of these CSV or .npy files without prompting or displaying anything')
+    parser.add_argument('--output-folder', default='.', help='folder to save rendered graphs in (default: %(default)s)')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='png',
+                        help='format of rendered graphs (default: %(default)s)')
+    parser.add_argument('--processes', type=int, help='number of graphs rendered in parallel (default: CPU count)')
+    arguments = parser.parse_args()
+
+    # If data files were provided, render them all with a non-interactive backend and exit
+    if arguments.files:
+        plt.switch_backend('Agg')
+        render_data_files(arguments.files, os.path.expanduser(arguments.output_folder), arguments.output_format,
+                          arguments.degrees, arguments.max_points, arguments.processes)
+        sys.exit()
+
+    # Lists to hold the names and lists of elements of the parameter and performance metric
+    names = []
+    all_elements_numeric = []
+
+    # Prompt the user to enter the name and values of two attributes
+    for attribute_name in ATTRIBUTE_NAMES:
+        # Prompt the user to enter the name of the parameter, stripping whitespace from it
+        print('Enter the name of the', attribute_name, 'to be plotted.')
+        names.append(input().strip())
+
+        # Prompt the user to enter the list of values of the given parameter
+        print('Enter the values of the', attribute_name, 'with elements separated by newlines.')
+        elements_numeric = read_numeric_elements()
+
+        # If they are not all numbers, print an error message and exit
+        if elements_numeric is None:
+            print('Non-numeric or incorrectly formatted input.')
+            sys.exit()
+        all_elements_numeric.append(elements_numeric)
+
+    # If the lengths of the two lists are different, exit with an error message
+    if len(all_elements_numeric[0]) != len(all_elements_numeric[1]):
+        print('Unequal number of', ATTRIBUTE_NAMES[0], 'points and', ATTRIBUTE_NAMES[1], 'points.')
+        sys.exit()
+
+    # If weighted fits were requested, prompt the user to enter a weight for each point
+    weights = None
+    if arguments.weighted:
+        print('Enter the weights of the points with elements separated by newlines.')
+        weights = read_numeric_elements()
+        if weights is None or len(weights) != len(all_elements_numeric[0]):
+            print('Non-numeric input, or a number of weights different from the number of points.')
+            sys.exit()
+
+    # Prompt the user to enter the title of the graph
+    print('Enter the title of this graph.')
+    title = input()
+
+    # Fit the polynomials of the requested degrees to the points and print out how well they fit
+    fits = fit_polynomials(*all_elements_numeric, arguments.degrees, weights)
+    print_fits(fits)
+
+    # Set the title of the window and plot the points and polynomials
+    plt.figure('Test Data Graphing Tool')
+    plot_fits(*all_elements_numeric, fits, names, title, arguments.max_points)
+
+    # Notify the user and show the graph
+    print('Opening the graph in a new window.')
+    plt.show()
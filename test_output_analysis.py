@@ -2,90 +2,419 @@
 
 from __future__ import print_function
 
+import argparse
+import csv
+import ctypes
+import ctypes.util
+import glob
+import json
 import math
 import os
+import select
+import struct
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 
 # A script for analyzing output data from an autonomous vehicle, including calculating the standard deviation from the
 # road line based on the file names, the average time elapsed per frame based on the timestamps of the files, and
 # calculating the geometric mean of the derivative of the error, which provides information on unwanted oscillation
+# Many run folders can be analyzed at once in parallel, producing a table with one row per run
+# The parsed timestamps and errors of each folder are cached in an index file beside it, which is updated incrementally
+# A folder can also be followed while a run is still writing to it, printing statistics at a fixed interval
+
+
+# The columns of the table produced when analyzing many folders
+TABLE_COLUMNS = ('folder', 'frame_count', 'average_frame_time', 'error_standard_deviation', 'derivative_error_rms')
+
+# The suffix of the name of the index file kept beside each image folder
+# It is kept outside of the folder, since writing it inside would change the modification time of the folder
+INDEX_FILE_SUFFIX = '.frame_index.npz'
+
+# The default number of seconds between printouts of statistics when following a folder
+FOLLOW_INTERVAL_SECONDS = 5
+
+# The weight given to each new frame time in the exponentially weighted moving average of the frame time
+FRAME_TIME_EWMA_WEIGHT = 0.1
+
+# The inotify event flags for a file that has been closed after writing or moved into a folder
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+
+# The format of the fixed-size header of an inotify event, which is followed by the file name
+INOTIFY_EVENT_HEADER = struct.Struct('iIII')
+
+
+# Parse the error from the name of an image file, which is the part of the name after the word 'error' and before the
+# first period after it
+def parse_error(file_name):
+    return int(file_name.split('error')[1].split('.')[0])
+
+
+# Get the path of the index file for a folder, which is a hidden file beside the folder
+def index_path(folder):
+    folder = os.path.normpath(os.path.abspath(folder))
+    return os.path.join(os.path.dirname(folder), '.' + os.path.basename(folder) + INDEX_FILE_SUFFIX)
+
+
+# Load the index of a folder, returning None if it does not exist or cannot be read
+def load_index(folder):
+    try:
+        with np.load(index_path(folder)) as index:
+            return {key: index[key] for key in index.files}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+# Save the index of a folder, writing to a temporary file first so that an interrupted write never leaves a corrupt
+# index behind; an index that cannot be written is simply not cached
+def save_index(folder, directory_mtime, names, timestamps, errors):
+    final_path = index_path(folder)
+    temporary_path = final_path[:-len('.npz')] + '.{}.tmp.npz'.format(os.getpid())
+    try:
+        np.savez(
+            temporary_path,
+            directory_mtime=np.int64(directory_mtime),
+            names=np.array(names, dtype=str),
+            timestamps=timestamps,
+            errors=errors
+        )
+        os.replace(temporary_path, final_path)
+    except OSError:
+        # Remove the temporary file if it was written but could not be moved into place
+        try:
+            os.remove(temporary_path)
+        except OSError:
+            pass
+
+
+# Get arrays of the names, timestamps, and errors of all of the images in a folder, parsing and reading metadata only
+# for the images that are not already in the folder's index
+def load_frames(folder):
+    # Get the modification time of the folder and the names of the files in it, which only requires the directory
+    # listing and not the metadata of every file
+    directory_mtime = os.stat(folder).st_mtime_ns
+    with os.scandir(folder) as entries:
+        names = [entry.name for entry in entries if entry.is_file()]
+
+    # If the index exists and the folder's modification time and number of files are the same as when it was saved,
+    # the folder has not changed, so use the index as it is
+    index = load_index(folder)
+    if index is not None and index['directory_mtime'] == directory_mtime and len(index['names']) == len(names):
+        return index['names'], index['timestamps'], index['errors']
+
+    # Otherwise, keep the entries from the index whose files are still in the folder
+    if index is not None:
+        kept_entries = np.isin(index['names'], names)
+        indexed_names = index['names'][kept_entries]
+        indexed_timestamps = index['timestamps'][kept_entries]
+        indexed_errors = index['errors'][kept_entries]
+    else:
+        indexed_names = np.array([], dtype=str)
+        indexed_timestamps = np.array([], dtype=np.float64)
+        indexed_errors = np.array([], dtype=np.float64)
+
+    # Parse the errors and read the timestamps of only the files that are not in the index
+    indexed_name_set = set(indexed_names.tolist())
+    new_names = [name for name in names if name not in indexed_name_set]
+    new_errors = np.array([parse_error(name) for name in new_names], dtype=np.float64)
+    new_timestamps = np.array([os.stat(os.path.join(folder, name)).st_mtime for name in new_names], dtype=np.float64)
+
+    # Combine the indexed and new entries, and save them as the new index
+    all_names = np.concatenate((indexed_names, np.array(new_names, dtype=str)))
+    timestamps = np.concatenate((indexed_timestamps, new_timestamps))
+    errors = np.concatenate((indexed_errors, new_errors))
+    save_index(folder, directory_mtime, all_names, timestamps, errors)
+
+    return all_names, timestamps, errors
+
+
+# Calculate the number of derivative iterations, the average frame time, the standard deviation of the error from the
+# center line, and the geometric mean of the approximate derivative of the error, given arrays of timestamps and errors
+def compute_metrics(timestamps, errors):
+    # Sort the timestamps so they are in chronological order, and keep the errors in the same order
+    chronological_order = np.argsort(timestamps, kind='stable')
+    timestamps_sorted = timestamps[chronological_order]
+    errors_sorted = errors[chronological_order]
+
+    # Get the number of iterations involved in the derivative calculation, which is one less than the number of files
+    num_iterations = len(timestamps) - 1
+
+    # Calculate the average frame time from the total time elapsed
+    total_delta_time = timestamps_sorted[-1] - timestamps_sorted[0]
+    average_frame_time = total_delta_time / num_iterations
+
+    # Calculate the standard deviation from the mean squared error
+    error_standard_deviation = np.sqrt(np.mean(np.square(errors)))
+
+    # Calculate the approximate derivative of the error with respect to time between every pair of consecutive frames,
+    # and the geometric mean of it from the mean squared derivative
+    derivative_error = np.diff(errors_sorted) / np.diff(timestamps_sorted)
+    derivative_error_geometric_mean = np.sqrt(np.mean(np.square(derivative_error)))
+
+    return num_iterations, average_frame_time, error_standard_deviation, derivative_error_geometric_mean
+
+
+# Load and analyze a single folder, returning a dictionary containing a value for each of the table columns
+# If the folder cannot be analyzed, print a warning and return a row with no frames, so that the other folders in a
+# table are still reported
+def analyze_folder(folder):
+    try:
+        _, timestamps, errors = load_frames(folder)
+        _, average_frame_time, error_standard_deviation, derivative_error_geometric_mean = \
+            compute_metrics(timestamps, errors)
+    # An empty folder has no first or last frame, and a file that is not a frame has no error in its name
+    except (IndexError, ValueError, OSError) as error:
+        print('Failed to analyze {}: {}'.format(folder, error), file=sys.stderr)
+        return {
+            'folder': folder,
+            'frame_count': 0,
+            'average_frame_time': math.nan,
+            'error_standard_deviation': math.nan,
+            'derivative_error_rms': math.nan
+        }
+    return {
+        'folder': folder,
+        'frame_count': len(timestamps),
+        'average_frame_time': float(average_frame_time),
+        'error_standard_deviation': float(error_standard_deviation),
+        'derivative_error_rms': float(derivative_error_geometric_mean)
+    }
+
+
+# Print out the results for a single folder in the original descriptive format
+def print_folder_results(folder):
+    # First, get all of the timestamps and errors from the file names and metadata of the provided folder
+    _, timestamps, errors = load_frames(folder)
+
+    # Compute all of the metrics in whole-array operations
+    num_iterations, average_frame_time, error_standard_deviation, derivative_error_geometric_mean = \
+        compute_metrics(timestamps, errors)
+    num_files = len(timestamps)
+
+    # Print out all of the results
+    print('Average frame time over', num_iterations, 'iterations:', average_frame_time)
+    print('Standard deviation from predicted center line over', num_files, 'images:', error_standard_deviation)
+    print('Geometric mean of approximate derivative of error from predicted center line over',
+          num_iterations, 'iterations:', derivative_error_geometric_mean)
+
+
+# Running statistics over a stream of frames, each of which is updated in constant time per frame
+class RunningStatistics:
+    # The number of frames, and the running mean and sum of squared deviations of the error (using Welford's algorithm)
+    frame_count = 0
+    error_mean = 0
+    error_squared_deviation_sum = 0
+
+    # The sum of the squared errors, giving the standard deviation from the center line used elsewhere in this script
+    error_squared_sum = 0
+
+    # The number of derivatives and the sum of their squares
+    derivative_count = 0
+    derivative_squared_sum = 0
+
+    # The exponentially weighted moving average of the time between frames
+    frame_time_average = None
+
+    # Add a frame's error, along with the derivative of the error and the time since the previous frame if there was one
+    def add(self, error, derivative=None, frame_time=None):
+        # Update the mean and sum of squared deviations of the error
+        self.frame_count += 1
+        deviation = error - self.error_mean
+        self.error_mean += deviation / self.frame_count
+        self.error_squared_deviation_sum += deviation * (error - self.error_mean)
+        self.error_squared_sum += error ** 2
+        # Update the sum of squared derivatives
+        if derivative is not None:
+            self.derivative_count += 1
+            self.derivative_squared_sum += derivative ** 2
+        # Update the moving average of the frame time, starting it at the first frame time
+        if frame_time is not None:
+            if self.frame_time_average is None:
+                self.frame_time_average = frame_time
+            else:
+                self.frame_time_average += FRAME_TIME_EWMA_WEIGHT * (frame_time - self.frame_time_average)
+
+    # Format the statistics as a single line, with NaN for any that do not have enough frames yet
+    def summary(self):
+        error_variance = self.error_squared_deviation_sum / self.frame_count if self.frame_count else math.nan
+        error_rms = math.sqrt(self.error_squared_sum / self.frame_count) if self.frame_count else math.nan
+        derivative_rms = math.sqrt(self.derivative_squared_sum / self.derivative_count) \
+            if self.derivative_count else math.nan
+        frame_time_average = math.nan if self.frame_time_average is None else self.frame_time_average
+        return '{} frames, frame time (EWMA): {:.4f}, error mean: {:.3f}, error standard deviation: {:.3f}, ' \
+               'error from center line: {:.3f}, derivative of error RMS: {:.3f}'.format(
+                self.frame_count, frame_time_average, self.error_mean, math.sqrt(error_variance), error_rms,
+                derivative_rms)
+
+
+# A watcher that uses Linux's inotify to get the names of files written into a folder, without listing the folder
+class InotifyWatcher:
+    # Set up an inotify instance watching the folder, raising OSError if inotify is not available
+    def __init__(self, folder):
+        libc_path = ctypes.util.find_library('c')
+        libc = ctypes.CDLL(libc_path, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.file_descriptor = libc.inotify_init1(os.O_NONBLOCK)
+        if self.file_descriptor < 0:
+            raise OSError(ctypes.get_errno(), 'Failed to initialize inotify')
+        if libc.inotify_add_watch(self.file_descriptor, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            raise OSError(ctypes.get_errno(), 'Failed to watch {}'.format(folder))
+
+    # Wait up to the provided number of seconds for files to be written, and return a list of their names
+    def new_file_names(self, timeout):
+        readable, _, _ = select.select([self.file_descriptor], [], [], max(timeout, 0))
+        if not readable:
+            return []
+        # Read all of the pending events and extract the names from them
+        events = os.read(self.file_descriptor, 65536)
+        names = []
+        offset = 0
+        while offset < len(events):
+            _, _, _, name_length = INOTIFY_EVENT_HEADER.unpack_from(events, offset)
+            offset += INOTIFY_EVENT_HEADER.size
+            # The name is padded with null bytes
+            names.append(os.fsdecode(events[offset:offset + name_length].rstrip(b'\0')))
+            offset += name_length
+        return names
+
+
+# A watcher that checks the modification time of a folder periodically, and only lists it when it has changed
+class PollingWatcher:
+    # The modification time of the folder when it was last listed
+    directory_mtime = None
+
+    # Store the folder and create the set of the names that have already been returned; the first check returns every
+    # file in the folder, so the caller must skip the ones it has already processed
+    def __init__(self, folder):
+        self.folder = folder
+        self.known_names = set()
+
+    # Wait for the provided number of seconds, and return the names of any files that have appeared since
+    def new_file_names(self, timeout):
+        time.sleep(max(timeout, 0))
+        directory_mtime = os.stat(self.folder).st_mtime_ns
+        if directory_mtime == self.directory_mtime:
+            return []
+        self.directory_mtime = directory_mtime
+        with os.scandir(self.folder) as entries:
+            names = [entry.name for entry in entries if entry.is_file() and entry.name not in self.known_names]
+        self.known_names.update(names)
+        return names
+
+
+# Follow a folder while a run is writing to it, printing statistics over the latest interval and the whole run
+def follow_folder(folder, interval):
+    # Start watching the folder before reading the existing frames, so that no new frames are missed
+    try:
+        watcher = InotifyWatcher(folder)
+    except (OSError, AttributeError):
+        watcher = PollingWatcher(folder)
+
+    # Read the existing frames, and remember their names along with every name processed later, so that a frame that
+    # is both listed here and reported by the watcher, or written more than once, is only counted once
+    names, timestamps, errors = load_frames(folder)
+    processed_names = set(names.tolist())
+
+    # Feed the frames that already exist into the statistics for the whole run, in chronological order
+    total_statistics = RunningStatistics()
+    chronological_order = np.argsort(timestamps, kind='stable')
+    previous_timestamp = None
+    previous_error = None
+    for timestamp, error in zip(timestamps[chronological_order].tolist(), errors[chronological_order].tolist()):
+        if previous_timestamp is not None and timestamp > previous_timestamp:
+            total_statistics.add(error, (error - previous_error) / (timestamp - previous_timestamp),
+                                 timestamp - previous_timestamp)
+        else:
+            total_statistics.add(error)
+        previous_timestamp, previous_error = timestamp, error
+    print('Existing frames:', total_statistics.summary())
+
+    # Create the statistics for the current interval, and get the time at which they will next be printed
+    window_statistics = RunningStatistics()
+    next_print_time = time.monotonic() + interval
+    while True:
+        # Wait for new files until it is time to print
+        for name in watcher.new_file_names(next_print_time - time.monotonic()):
+            if name in processed_names:
+                continue
+            # Parse the error and get the timestamp, skipping files that are not frames or have already been removed
+            try:
+                error = parse_error(name)
+                timestamp = os.stat(os.path.join(folder, name)).st_mtime
+            except (IndexError, ValueError, OSError):
+                continue
+            processed_names.add(name)
+            # Add the frame to both sets of statistics, with a derivative if time has passed since the previous frame
+            derivative = None
+            frame_time = None
+            if previous_timestamp is not None and timestamp > previous_timestamp:
+                frame_time = timestamp - previous_timestamp
+                derivative = (error - previous_error) / frame_time
+            for statistics in (window_statistics, total_statistics):
+                statistics.add(error, derivative, frame_time)
+            previous_timestamp, previous_error = timestamp, error
+
+        # If it is time, print the statistics and start a new interval
+        if time.monotonic() >= next_print_time:
+            print('Last {} seconds: {}'.format(interval, window_statistics.summary()))
+            print('Whole run: {}'.format(total_statistics.summary()))
+            window_statistics = RunningStatistics()
+            next_print_time += interval
+
+
+if __name__ == '__main__':
+    # Parse the command line arguments
+    parser = argparse.ArgumentParser(description='Analyze the output images of one or more driving runs.')
+    parser.add_argument('folders', nargs='+', metavar='image_folder',
+                        help='image folders, or glob patterns matching them')
+    parser.add_argument('--format', choices=('text', 'csv', 'json'),
+                        help='output format (default: text for a single folder, csv for several)')
+    parser.add_argument('--processes', type=int, help='number of folders analyzed in parallel (default: CPU count)')
+    parser.add_argument('--follow', action='store_true',
+                        help='keep watching a single folder for new frames and print statistics periodically')
+    parser.add_argument('--interval', type=float, default=FOLLOW_INTERVAL_SECONDS,
+                        help='seconds between printouts when following a folder (default: %(default)s)')
+    arguments = parser.parse_args()
+
+    # Expand any glob patterns that were not already expanded by the shell, keeping plain paths as they are
+    folders = []
+    for pattern in arguments.folders:
+        pattern = os.path.expanduser(pattern)
+        folders += sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+    if not folders:
+        sys.exit('No folders matched')
+
+    # If following was requested, follow the single folder until the script is interrupted
+    if arguments.follow:
+        if len(folders) != 1:
+            parser.error('only a single folder can be followed')
+        try:
+            follow_folder(folders[0], arguments.interval)
+        except KeyboardInterrupt:
+            pass
+        sys.exit()
+
+    # Use text output for a single folder and a CSV table for several unless a format was chosen
+    output_format = arguments.format or ('text' if len(folders) == 1 else 'csv')
 
+    # If text output was requested, print the results of each folder in turn
+    if output_format == 'text':
+        for folder in folders:
+            print_folder_results(folder)
 
-# Check that the number of command line arguments is correct
-if len(sys.argv) != 2:
-    print('Usage:', sys.argv[0], '<image folder>')
-    sys.exit()
-
-# First, get all of the timestamps and errors from the file names and metadata
-# Parse the provided folder path
-folder = os.path.expanduser(sys.argv[1])
-
-# Gather a list of timestamps and a list of errors for later processing
-timestamps = []
-errors = []
-
-# Iterate over all of the image names in the folder
-file_names = os.listdir(folder)
-for file_name in file_names:
-    # Get the part of the file name after the word 'error'
-    file_name_end = file_name.split('error')[1]
-
-    # The error is the part of the remaining name before the first period
-    error = int(file_name_end.split('.')[0])
-
-    # Add it to the list
-    errors.append(error)
-
-    # Get the timestamp of the file and add it to the list
-    timestamp = os.path.getmtime('{}/{}'.format(folder, file_name))
-    timestamps.append(timestamp)
-
-# Next task is to compute the average frame time and geometric mean of the approximate derivative of the error
-# Sort the timestamps so they are iterated over, and keep them in order with the corresponding errors
-timestamps_with_errors = zip(timestamps, errors)
-timestamps_with_errors_sorted = sorted(timestamps_with_errors, key=lambda timestamp_and_error: timestamp_and_error[0])
-
-# Split them into two lists once again
-timestamps_with_errors_unzipped = list(zip(*timestamps_with_errors_sorted))
-timestamps_sorted = timestamps_with_errors_unzipped[0]
-errors_sorted = timestamps_with_errors_unzipped[1]
-
-# Add up the time deltas and the squared derivatives while iterating
-total_squared_derivative_error = 0
-
-# Iterate over the sorted timestamps and errors
-for i in range(1, len(timestamps_with_errors_sorted)):
-    # Get the indices for the current iteration and the previous one
-    current_iteration = i
-    previous_iteration = i - 1
-
-    # Calculate the approximate derivative of the error with respect to time at this point
-    delta_time = timestamps_sorted[current_iteration] - timestamps_sorted[previous_iteration]
-    delta_error = errors_sorted[current_iteration] - errors_sorted[previous_iteration]
-    derivative_error = delta_error / delta_time
-
-    # Add the square of the derivative to the total
-    squared_derivative_error = derivative_error ** 2
-    total_squared_derivative_error += squared_derivative_error
-
-# Perform final calculations and print out all of the results
-# Get the number of files there are in the list and the number of iterations involved in the derivative calculation
-num_files = len(file_names)
-num_iterations = num_files - 1
-
-# Calculate and print the average frame time
-total_delta_time = timestamps_sorted[-1] - timestamps_sorted[0]
-average_frame_time = total_delta_time / num_iterations
-print('Average frame time over', num_iterations, 'iterations:', average_frame_time)
-
-# Calculate and print the standard deviation from the total squared error
-total_squared_error = sum([error ** 2 for error in errors])
-error_variance = total_squared_error / num_files
-error_standard_deviation = math.sqrt(error_variance)
-print('Standard deviation from predicted center line over', num_files, 'images:', error_standard_deviation)
-
-# Calculate and print the geometric mean of the total squared error derivative
-derivative_error_variance = total_squared_derivative_error / num_iterations
-derivative_error_geometric_mean = math.sqrt(derivative_error_variance)
-print('Geometric mean of approximate derivative of error from predicted center line over',
-      num_iterations, 'iterations:', derivative_error_geometric_mean)
+    # Otherwise, analyze the folders in parallel across processes and print one row per run
+    else:
+        with ProcessPoolExecutor(max_workers=arguments.processes) as executor:
+            rows = executor.map(analyze_folder, folders)
+            if output_format == 'csv':
+                writer = csv.DictWriter(sys.stdout, fieldnames=TABLE_COLUMNS)
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+            else:
+                for row in rows:
+                    print(json.dumps(row))